@@ -13,16 +13,27 @@ This file is distributed under the MIT license (http://opensource.org/licenses/M
 import random
 import math
 import operator
+import numpy as np
+from fitcache import fitness_cache
+from stopping import max_iterations, first_fired
+from diversity import first_occurrences, sample_pairs
 
 
 class aco():
     """
     Basic Ant Colony Optimization
     """
+    # Evaporation is applied lazily: the pheromone matrix holds values relative
+    # to a global scale factor (true pheromone = stored value * _ph_scale), and
+    # the stored values are only rescaled when the factor drops below this (or
+    # below the limit for the dtype and alpha, see __init__)
+    _min_ph_scale = 1e-10
     
     def __init__(self, sol_length, num_ants=50, default_ph=1,
                  evaporation=0.95, heuristics=None, num_ants_ph=3, elitism=1,
-                 alpha=1, beta=1, max_iter=1000, rand_seed=None, rand_offset=0):
+                 alpha=1, beta=1, max_iter=1000, rand_seed=None, rand_offset=0,
+                 cache_size=0, stop_criteria=None, dtype=np.float32,
+                 suppress_duplicates=True):
         """
         Initializaton of the ACO:
         The following parametres are needed (defaults will be used if no value
@@ -35,7 +46,7 @@ class aco():
         - Heuristics: the values to use as heuristics when determining
           candidates. Make sure to use the format that you expect in your
           ant() method. For the default, heuristics[x][b] is the value
-          associated to value b in position x (list of lists)
+          associated to value b in position x (list of lists or array)
         - Number of ants in each iteration that deposit pheromone
         - Elitism: the number of best solutions so far that deposit pheromone
           each iteration (apart from the iteration ants)
@@ -44,9 +55,23 @@ class aco():
         - Maximum number of iterations
         - Random Seed: a seed can be provided to replicate a result; if no seed
           is provided, the rng is initialized in the standard fashion
-        - Random Offset: If a number > 0 is provided, the state of the rng will
-          be advanced by that quantity (useful for parallel runs with
-          deterministic seeds by providing a different offset for each instance)
+        - Random Offset: If a number > 0 is provided along with a seed, the
+          rng is seeded from both, so each offset gives a different stream
+          (useful for parallel runs with deterministic seeds by providing a
+          different offset for each instance)
+        - Cache Size: maximum number of fitness values to keep in a cache to
+          avoid evaluating again solutions already seen (least recently used
+          values are discarded first); 0 disables the cache
+        - Stop Criteria: additional end conditions (see the stopping module),
+          checked after the maximum number of iterations; the name of the one
+          that ends the run is kept in _stop_reason
+        - Data Type: numpy dtype of the pheromone and heuristic matrices, which
+          are kept as arrays. The float32 default halves the memory needed with
+          respect to float64 (and takes a fraction of that of lists of Python
+          floats), which matters for large instances on small nodes
+        - Suppress Duplicates: if True, only one copy of each solution is kept
+          when ranking the ants and the elite solutions, so that the same
+          solution does not deposit pheromone several times
         Additionally, the ACO is reset by instantiating an empty population
         and setting the best solution and fitness value to None, zeroing the
         iteration counter and resetting the pheromone matrix
@@ -57,8 +82,11 @@ class aco():
         self._pop = []
         self._default_ph = default_ph
         self._evaporation = evaporation
+        self._dtype = np.dtype(dtype)
         self.init_ph()
         self._num_ants_ph = num_ants_ph
+        if heuristics is not None:
+            heuristics = np.asarray(heuristics, dtype=self._dtype)
         self._heuristics = heuristics
         self._num_iters = 0
         self._best_obj = None
@@ -66,17 +94,35 @@ class aco():
         self._elitism = elitism
         self._alpha = alpha
         self._beta = beta
+        # The stored pheromone grows as the scale factor shrinks, and it is
+        # raised to alpha for the choice information, so the values are
+        # rescaled before 1 / scale ** alpha gets close to the square root of
+        # the largest value of the dtype (about 1e-4 for float32 and alpha 5)
+        self._min_ph_scale = max(
+            self._min_ph_scale,
+            float(np.finfo(self._dtype).max) ** (-0.5 / max(alpha, 1)))
         self._max_iter = max_iter
+        self._stop_criteria = [max_iterations(max_iter)]
+        if stop_criteria:
+            self._stop_criteria.extend(stop_criteria)
+        self._stop_reason = None
+        self._suppress_duplicates = suppress_duplicates
+        # Fraction of unique solutions among those last ranked, and the ranked
+        # ants of the last iteration, for diversity
+        self._unique_fraction = 1.0
+        self._colony = []
         self._random = random.Random()
+        if rand_offset and rand_seed is not None:
+            # Strings are hashed into the whole state of the rng
+            rand_seed = "{}/{}".format(rand_seed, rand_offset)
         self._random.seed(rand_seed)
-        if rand_offset:
-            self._random.jumpahead(rand_offset)
-        # Define the operations needed for calculating the pheromone and
-        # heuristic impacts for candidate selection
-        self._pow_alpha = lambda x: pow(x, self._alpha)
-        self._pow_beta = lambda x: pow(x, self._beta)
+        # Vectorized operations draw their random numbers in bulk from a numpy
+        # generator, seeded from the main rng so that runs remain repeatable
+        self._np_random = np.random.default_rng(self._random.getrandbits(64))
         # Incoming population: if exists, add to the self-generated population
         self._incoming_population = []
+        # Fitness cache, only if a capacity is provided
+        self._cache = fitness_cache(cache_size) if cache_size else None
 
     def init_ph(self):
         """
@@ -86,12 +132,19 @@ class aco():
         this method to provide a suitable initialization. This is called from
         self.__init__() during instatiation.
         """
-        # for each element in the solution, there is a list with the pheromone
-        # associated to 0 and 1 as values: pheromones[x][b] is the pheromone
+        # for each element in the solution, there is a row with the pheromone
+        # associated to 0 and 1 as values: pheromones[x, b] is the pheromone
         # corresponding to b in position x of the solution
-        self._pheromones = [[self._default_ph] * 2 for _ in
-                            range(self._sol_length)]
-        self._base = [pow(2, n) for n in range(self._sol_length)]
+        self._pheromones = np.full((self._sol_length, 2), self._default_ph,
+                                   dtype=self._dtype)
+        self._ph_scale = 1.0
+
+    def pheromones(self):
+        """
+        Return the (true) pheromone values, i.e. the stored pheromone matrix
+        with the pending evaporation applied
+        """
+        return self._pheromones * self._ph_scale
 
     def ant(self):
         """
@@ -100,9 +153,8 @@ class aco():
         This method builds a (randomized) solution based on the pheromone and
         heuristics matrices and returns it.
 
-        This version expects each matrix to be a list of lists where
-        matrix[x][b] is the value associated to value b at position x of the
-        solution.
+        This version expects each matrix to be an array where matrix[x, b] is
+        the value associated to value b at position x of the solution.
 
         The solution building process randomly decides a value for each position
         with probabilities proportional to s_i = (p_i)^a * (h_i)^b. p_i is the
@@ -112,46 +164,161 @@ class aco():
 
         If no euristics are available, they are ignored (equivalent to all
         heuristic values being 1).
+
+        For the binary values, this is a Bernoulli draw at each position with
+        the probability of 1 given by _one_probs().
         
         Override this method to customize your solution building procedure.
         """
-        mysol = []
-        for s in range(self._sol_length):
-            pherom_probs = (self._pow_alpha(pheromone)
-                            for pheromone in self._pheromones[s])
-            if self._heuristics:
-                heuristic_probs = (self._pow_beta(heur)
-                                   for heur in self._heuristics[s])
-                probs = [pherom_prob * heur_prob
-                         for pherom_prob, heur_prob in zip(pherom_probs,
-                                                           heuristic_probs)]
-            else:
-                probs = list(pherom_probs)
-            sum_probs = sum(probs)
-            rnd_num = self._random.uniform(0, sum_probs)
-            select = -1
-            cum_prob = 0
-            while cum_prob <= rnd_num:  # Always goes in at least once
-                select += 1
-                cum_prob += probs[select]
-            mysol.append(select)
-        return mysol
-
-    def _rank_pop(self, pop):
+        one_probs = self._one_probs()
+        return (self._np_random.random(self._sol_length) <
+                one_probs).astype(int).tolist()
+
+    def _one_probs(self):
+        """
+        Return the array with the probability of choosing 1 at each position of
+        the solution, s_1 / (s_0 + s_1) (see ant)
+        """
+        probs = self._pheromones ** self._alpha
+        if self._heuristics is not None:
+            probs = probs * self._heuristics ** self._beta
+        return probs[:, 1] / probs.sum(axis=1)
+
+    def _build_colony(self):
+        """
+        Build the solutions of all the ants for an iteration
+
+        Return the list of solutions and the list of their fitness values, or
+        None in place of the latter if they are not known and have to be
+        evaluated when ranking.
+
+        For the binary representation, the probabilities of each position are
+        computed once, and the solutions of the whole colony are drawn at once
+        as a num_ants-by-sol_length matrix of bits. If ant() is overridden, it
+        is called for each ant instead.
+
+        Override this method to build the solutions in a different way (e.g.
+        calculating their fitness during the construction)
+        """
+        if type(self).ant is not aco.ant:
+            return [self.ant() for _ in range(self._num_ants)], None
+        one_probs = self._one_probs()
+        bits = (self._np_random.random((self._num_ants, self._sol_length)) <
+                one_probs)
+        return bits.astype(int).tolist(), None
+
+    def _rank_pop(self, pop, fitness=None):
         """
         Rank a population based on the fitness value
 
         Return a list with the elements of pop sorted by fitness in ascending
         order. The list contains (individual, fitness) tuples.
 
+        Optionally, fitness is a list with the values already known for the
+        individuals in pop (None for those not known). Only the individuals
+        without a known value are evaluated.
+
+        The fraction of unique solutions (as identified by _cache_keys) is
+        recorded (see diversity), and if duplicate suppression is enabled, only
+        the first copy of each one is kept, before evaluating them.
+
         Override this method to provide a diffrent ranking mechanism
         (e.g. for maximization or for multiobjective)
         """
+        if pop:
+            keep = first_occurrences(self._cache_keys(pop))
+            self._unique_fraction = len(keep) / float(len(pop))
+            if self._suppress_duplicates and len(keep) < len(pop):
+                pop = [pop[pos] for pos in keep]
+                if fitness is not None:
+                    fitness = [fitness[pos] for pos in keep]
+        if fitness is None:
+            fitness = self._evaluate(pop)
+        else:
+            unknown = [pos for pos, fit in enumerate(fitness) if fit is None]
+            if unknown:
+                fitness = list(fitness)
+                values = self._evaluate([pop[pos] for pos in unknown])
+                for pos, fit in zip(unknown, values):
+                    fitness[pos] = fit
         # Decorate - sort - undecorate pattern
-        decorated_pop = list(zip(pop, map(self._fitness, pop)))
+        decorated_pop = list(zip(pop, fitness))
         decorated_pop.sort(key=operator.itemgetter(1))
         return decorated_pop
 
+    def _evaluate(self, pop):
+        """
+        Return a list with the fitness values of the solutions in pop
+
+        If the fitness cache is enabled, the values are looked up there first,
+        and only the solutions not found are evaluated, storing their values in
+        the cache.
+        """
+        if self._cache is None:
+            return list(map(self._fitness, pop))
+        keys = self._cache_keys(pop)
+        fitness, missing = self._cache.lookup(keys)
+        if missing:
+            missing_fitness = [self._fitness(pop[pos]) for pos in missing]
+            for pos, fit in zip(missing, missing_fitness):
+                fitness[pos] = fit
+            self._cache.store([keys[pos] for pos in missing], missing_fitness)
+        return fitness
+
+    def _cache_keys(self, pop):
+        """
+        Return the list of keys identifying each solution in the fitness cache
+
+        For the binary representation, the tuple of values is used.
+
+        Override this method to provide cheap keys (e.g. hashes) for a
+        different representation
+        """
+        return [tuple(sol) for sol in pop]
+
+    def _distance(self, sols1, sols2):
+        """
+        Return the distance between each pair of solutions (sols1[i],
+        sols2[i]) as a fraction: for the binary representation, the fraction
+        of positions that differ
+
+        Override this method to use a suitable distance for a different
+        representation
+        """
+        return np.mean(np.asarray(sols1) != np.asarray(sols2), axis=1)
+
+    def diversity(self, num_pairs=100):
+        """
+        Return the diversity of the ants of the last iteration as a dictionary
+        with:
+        - unique_fraction: fraction of unique solutions among those ranked
+          (the duplicates are suppressed if enabled)
+        - mean_distance: mean distance (see _distance) between pairs of
+          ranked solutions, estimated over num_pairs random pairs (or all of
+          them, if there are fewer)
+
+        The pairs are drawn with a generator of their own, so that calling it
+        does not change the course of the run.
+        """
+        rng = np.random.default_rng(self._num_iters)
+        first, second = sample_pairs(len(self._colony), num_pairs, rng)
+        if len(first):
+            mean_distance = float(np.mean(self._distance(
+                [self._colony[pos] for pos in first],
+                [self._colony[pos] for pos in second])))
+        else:
+            mean_distance = 0.0
+        return {"unique_fraction": self._unique_fraction,
+                "mean_distance": mean_distance}
+
+    def cache_stats(self):
+        """
+        Return the counters of the fitness cache (hits, misses and stored
+        entries) as a dictionary, or None if the cache is not enabled
+        """
+        if self._cache is None:
+            return None
+        return self._cache.stats()
 
     def _fitness(self, indiv):
         """
@@ -167,53 +334,90 @@ class aco():
         """
         return sum(indiv)
 
+    def _improve(self, pop):
+        """
+        Improvement stage applied to the ranked ants of each iteration, before
+        the pheromone update (e.g. local search on the best ones)
+
+        Return the resulting population, ranked. This version does nothing.
+
+        Override this method to add an improvement stage for a given problem.
+        """
+        return pop
+
     def _end_condition(self):
         """
         Determine whether the algorithm is considered finished.
 
-        The end condition here is number of iterations >= max_iter
+        The end condition here is number of iterations >= max_iter, or any of
+        the additional stop criteria provided. The name of the criterion that
+        fires is recorded in _stop_reason.
 
         Override this method to generate a suitable end condition for a
         different problem or representation
         """
-        return self._num_iters >= self._max_iter
+        self._stop_reason = first_fired(self._stop_criteria, self._num_iters,
+                                        self._best_obj)
+        return self._stop_reason is not None
 
     def _update_ph(self, pop):
         """
         Update the pheromone matrix for each (sol, fitness) tuple in population
 
         The update is by 1 /(1 + fitness) to avoid problems with division by
-        zero.
+        zero. Since the stored values are relative to the evaporation scale
+        factor, deposits are divided by it.
 
         Override this method to use a different pheromone update scheme.
         """
+        positions = np.arange(self._sol_length)
         for sol, fit in pop[:self._num_ants_ph]:
-            ph = 1.0 / (1 + fit)
-            for s in range(self._sol_length):
-                self._pheromones[s][sol[s]] += ph
+            ph = 1.0 / (1 + fit) / self._ph_scale
+            self._pheromones[positions, sol] += ph
 
     def _evaporate(self):
         """
         Apply evaporation
 
+        Evaporation affects all the pheromone values equally, so it is kept as
+        a global scale factor instead of updating the whole matrix. The choice
+        probabilities, being proportional to the pheromone, are not affected.
+        When the factor gets too small, it is applied to the stored values
+        (see _renormalize_ph) to avoid overflow in the deposits.
+        """
+        self._ph_scale *= self._evaporation
+        if self._ph_scale < self._min_ph_scale:
+            self._renormalize_ph()
+
+    def _renormalize_ph(self):
+        """
+        Apply the accumulated evaporation scale factor to the stored pheromone
+        values and reset it
+
         Override this to adapt it to your own pheromone matrix implementation
         """
-        for s in range(self._sol_length):
-            for p in [0, 1]:  # Implementation specific for the binary values
-                self._pheromones[s][p] *= self._evaporation
+        self._pheromones *= self._ph_scale
+        self._ph_scale = 1.0
     
     def _run_iteration(self):
         """
         Execute and iteration of the ACO
         """
-        pop = [self.ant() for _ in range(self._num_ants)]
+        pop, fitness = self._build_colony()
         if self._incoming_population:
             pop.extend(self._incoming_population)
-        ranked_pop = self._rank_pop(pop)
+            if fitness is not None:
+                fitness.extend([None] * len(self._incoming_population))
+        ranked_pop = self._improve(self._rank_pop(pop, fitness))
+        self._colony = [sol for sol, _ in ranked_pop]
         pheromone_ants = ranked_pop[:self._num_ants_ph]
         if self._elitism:
             pheromone_ants.extend(self._pop)
             self._pop.extend(ranked_pop[:self._elitism])
+            if self._suppress_duplicates:
+                keep = first_occurrences(
+                    self._cache_keys([sol for sol, _ in self._pop]))
+                self._pop = [self._pop[pos] for pos in keep]
             self._pop.sort(key=operator.itemgetter(1))
             self._pop = self._pop[:self._elitism]
         self._update_ph(pheromone_ants)
@@ -239,4 +443,4 @@ if __name__ == "__main__":
     myaco = aco(sol_length=sol_len, max_iter=max_it, heuristics=heur)
     myaco._run()
     print(myaco._best_sol, myaco._best_obj)
-    print(myaco._pheromones)
+    print(myaco.pheromones())
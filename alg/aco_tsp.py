@@ -12,7 +12,12 @@ This file is distributed under the MIT license (http://opensource.org/licenses/M
 """
 
 import random
+import numpy as np
 from aco import aco
+from fitcache import tour_hash
+from candidates import candidate_lists
+from antpool import ant_pool
+from diversity import arc_distance
 import operator
 
 
@@ -22,7 +27,11 @@ class aco_tsp(aco):
     """
     def __init__(self, cost_matrix, num_ants=50, default_ph=1,
                  evaporation=0.95, heuristics=None, num_ants_ph=3, elitism=1,
-                 alpha=1, beta=1, max_iter=1000, rand_seed=None, rand_offset=0):
+                 alpha=1, beta=1, max_iter=1000, rand_seed=None, rand_offset=0,
+                 cache_size=0, local_search=None, ls_top_k=1,
+                 stop_criteria=None, num_candidates=None, candidates=None,
+                 batch_ants=False, dtype=np.float32, sparse_ph=False,
+                 num_workers=0, suppress_duplicates=True):
         """
         Initializaton of the ACO:
         The following parametres are needed (defaults will be used if no value
@@ -48,9 +57,47 @@ class aco_tsp(aco):
         - Maximum number of iterations
         - Random Seed: a seed can be provided to replicate a result; if no seed
           is provided, the rng is initialized in the standard fashion
-        - Random Offset: If a number > 0 is provided, the state of the rng will
-          be advanced by that quantity (useful for parallel runs with
-          deterministic seeds by providing a different offset for each instance)
+        - Random Offset: If a number > 0 is provided along with a seed, the
+          rng is seeded from both, so each offset gives a different stream
+          (useful for parallel runs with deterministic seeds by providing a
+          different offset for each instance)
+        - Cache Size: maximum number of fitness values to keep in a cache to
+          avoid evaluating again tours already seen; 0 disables the cache
+        - Local Search: an object with an improve_batch(tours, costs) method
+          returning the improved tours and costs (e.g. a
+          localsearch.local_search), applied each iteration to the best ants
+          before the pheromone update; None disables it
+        - Local Search Top k: number of best ants improved by the local search
+          each iteration
+        - Stop Criteria: additional end conditions (see the stopping module),
+          checked after the maximum number of iterations; the name of the one
+          that ends the run is kept in _stop_reason
+        - Number of Candidates: if provided, each ant chooses the next city
+          among the (unvisited) num_candidates best successors of the current
+          one by heuristic value, and only when all of them have been visited,
+          takes the best remaining city. None considers all the cities
+        - Candidates: precomputed candidate lists (an n-by-k array with the
+          successors of each city, e.g. from candidates.candidate_lists), to
+          share them between instances solving the same problem; overrides
+          num_candidates
+        - Batch Ants: if True, the tours of all the ants of an iteration are
+          built together, advancing the whole colony one step at a time with
+          vectorized operations over num_ants-by-n arrays, instead of one ant
+          after the other
+        - Data Type: numpy dtype of the pheromone, heuristic and choice
+          information matrices (float32 by default)
+        - Sparse Pheromone: if True, pheromone (and choice information) is only
+          kept for the arcs in the candidate lists, as n-by-k matrices where
+          ph[a, i] is the pheromone of the arc from a to its i-th candidate,
+          instead of n-by-n. It requires candidate lists. The arcs outside them
+          get no pheromone, and when all the candidates of a city have been
+          visited, the next one is chosen by heuristic value alone
+        - Number of Workers: if more than 1, the ants of each iteration are
+          built in parallel by this number of worker processes (see the antpool
+          module), reading the choice information from shared memory. Call
+          close() when done to stop them
+        - Suppress Duplicates: if True, only one copy of each tour (in any
+          rotation) is kept when ranking the ants and the elite tours
         Additionally, the ACO is reset by instantiating an empty population
         and setting the best solution and fitness value to None, zeroing the
         iteration counter and resetting the pheromone matrix
@@ -58,29 +105,112 @@ class aco_tsp(aco):
 
         # TODO: Find good default values for params
         self._cost_matrix = cost_matrix
+        # Array version of the cost matrix, cm[a, b] is the cost of the arc
+        # from a to b
+        self._cm = np.asarray(cost_matrix)
         sol_len = len(cost_matrix)
         # Default heuristic is 1 / (1 + arc cost), but use alternate if provided
         if heuristics is not None:
-            heur = heuristics
+            heur = np.asarray(heuristics, dtype=dtype)
         else:
-            heur = [[1.0 / (1 + x) for x in cost_row]
-                    for cost_row in cost_matrix]
-#        print(cost_matrix)
-#        print(heur)
-#        print()
+            heur = (1.0 / (1 + self._cm)).astype(dtype)
+        # Tours are identified in the fitness cache by their hash, the same
+        # for all the rotations of a tour
+        self._tour_hash = tour_hash(sol_len, rotations=True)
+        self._local_search = local_search
+        self._ls_top_k = ls_top_k
+        # Candidate lists are built once, from the heuristics, and before the
+        # pheromone matrix, which depends on them in sparse mode
+        if candidates is not None:
+            self._candidates = np.asarray(candidates)
+        elif num_candidates:
+            self._candidates = candidate_lists(-heur, num_candidates)
+        else:
+            self._candidates = None
+        if sparse_ph and self._candidates is None:
+            raise ValueError("Sparse pheromone storage needs candidate lists")
+        self._sparse_ph = sparse_ph
         super().__init__(sol_len, num_ants, default_ph, evaporation, heur,
                          num_ants_ph, elitism, alpha, beta, max_iter,
-                         rand_seed, rand_offset)
+                         rand_seed, rand_offset, cache_size, stop_criteria,
+                         dtype, suppress_duplicates)
+        # The heuristic part of the choice information does not change
+        if self._sparse_ph:
+            self._heur_beta = np.take_along_axis(
+                self._heuristics, self._candidates, axis=1) ** self._beta
+        elif self._beta == 1:
+            # No copy of the heuristics, which may be shared with other
+            # processes (see mpi_multirun)
+            self._heur_beta = self._heuristics
+        else:
+            self._heur_beta = self._heuristics ** self._beta
+        self._batch_ants = batch_ants
+        # The pool is started last, so that the workers get a complete copy of
+        # the colony
+        self._ant_pool = None
+        if num_workers > 1:
+            self._ant_pool = ant_pool(self, num_workers,
+                                      self._pheromones.shape, self._dtype,
+                                      int(self._np_random.integers(2**63)))
+
+    def close(self):
+        """
+        Stop the worker processes building the ants, if any; construction goes
+        on in this process afterwards
+        """
+        if self._ant_pool is not None:
+            # The choice information lives in the shared memory to release
+            self._choice = None
+            self._ant_pool.close()
+            self._ant_pool = None
 
     def init_ph(self):
         """
         Initialize the pheromone matrix
 
         The pheromone matrix is an n-by-n matrix where ph[a][b] is the pheromone
-        associated to element b following element a in the tour
+        associated to element b following element a in the tour (n-by-k, for
+        the candidates of each element, in sparse mode)
         """
         sl = self._sol_length
-        self._pheromones = [[self._default_ph] * sl for _ in range(sl)]
+        if self._sparse_ph:
+            shape = self._candidates.shape
+        else:
+            shape = (sl, sl)
+        self._pheromones = np.full(shape, self._default_ph, dtype=self._dtype)
+        self._ph_scale = 1.0
+        # Choice information derived from the pheromone, see _choice_info
+        self._choice = None
+
+    def pheromones(self):
+        """
+        Return the (true) pheromone matrix, with the pending evaporation applied
+        """
+        return self._pheromones * self._ph_scale
+
+    def _choice_info(self):
+        """
+        Return the choice information matrix, where choice[a, b] is
+        pheromone^alpha * heuristic^beta for the arc from a to b (from a to its
+        b-th candidate in sparse mode)
+
+        The matrix is computed from the stored pheromone values, which leaves
+        out the evaporation scale factor common to all of them, so it does not
+        change with evaporation. It is computed once and then only updated for
+        the arcs that receive pheromone (see _update_ph); a full recomputation
+        is only needed when the pheromone matrix is reset or renormalized.
+
+        With a pool of workers, the matrix is kept in the shared memory block
+        they read it from.
+        """
+        if self._choice is None:
+            choice = self._pheromones ** self._alpha * self._heur_beta
+            if self._ant_pool is not None:
+                self._choice = self._ant_pool.choice_buffer()
+                self._choice[...] = choice
+            else:
+                self._choice = choice
+        return self._choice
 
     def ant(self):
         """
@@ -91,39 +221,156 @@ class aco_tsp(aco):
         selection of the first element can be arbitrary, and we choose element
         zero. Keep adding elements until all are used (full tour)
         """
-        mysol = []
-        cities = list(range(self._sol_length))
-        mysol.append(cities.pop(0))
-        while cities:
-            # All candidate arcs start at the last city in the tour so far
-            orig = mysol[-1]
-            # Get the pheromones and heuristics for arcs from orig to the
-            # remaining candidate cities
-            pheroms = (self._pheromones[orig][s] for s in cities)
-            heurs = (self._heuristics[orig][s] for s in cities)
-            # Same origin and destination is not possible because origin has
-            # already been popped out of cities, therefore no filtering in
-            # pheroms and heurs above
-            probs = [self._pow_alpha(pheromone) * self._pow_beta(heur)
-                     for pheromone, heur in zip(pheroms, heurs)]
-            sum_probs = sum(probs)
-            rnd_num = self._random.uniform(0, sum_probs)
-            select = -1
-            cum_prob = 0
-            while cum_prob <= rnd_num:  # Always goes in at least once
-                select += 1
-                if select > len(cities):
-                    print(select)
-                    print(cities)
-                    print(rnd_num)
-                    print(cum_prob)
-                    print(probs)
-                    print(sum_probs)
-                    print(self._pheromones)
-                    print(self._heuristics)
-                cum_prob += probs[select]
-            mysol.append(cities.pop(select))
-        return mysol
+        return self._construct_ant()[0]
+
+    def _construct_ant(self):
+        """
+        Build the tour of an ant (see ant) and return it along with its cost
+
+        The cost of the tour is accumulated as the arcs are added.
+        """
+        n = self._sol_length
+        choice = self._choice_info()
+        tour = [0]
+        # 1 for the cities not visited yet, 0 for the visited ones
+        unvisited = np.ones(n)
+        unvisited[0] = 0
+        cost = 0
+        rnd_nums = self._np_random.random(n - 1).tolist()
+        orig = 0
+        for rnd_num in rnd_nums:
+            select = self._next_city(choice, orig, unvisited, rnd_num)
+            tour.append(select)
+            unvisited[select] = 0
+            cost += self._cm[orig, select]
+            orig = select
+        cost += self._cm[orig, 0]
+        return tour, cost.item()
+
+    def _next_city(self, choice, orig, unvisited, rnd_num):
+        """
+        Select the next city of a tour from orig, given the choice information
+        matrix, the mask of unvisited cities, and a random number in [0, 1)
+
+        The city is drawn with probability proportional to its choice value
+        among the unvisited candidates of orig (or all the unvisited cities if
+        there are no candidate lists), using a cumulative sum and a binary
+        search. If all the candidates have been visited, the unvisited city
+        with the highest choice value is taken.
+        """
+        if self._candidates is not None:
+            cands = self._candidates[orig]
+            if self._sparse_ph:
+                cand_choice = choice[orig]
+            else:
+                cand_choice = choice[orig, cands]
+            cum_probs = np.cumsum(cand_choice * unvisited[cands])
+            if cum_probs[-1] > 0:
+                select = np.searchsorted(cum_probs, rnd_num * cum_probs[-1],
+                                         side='right')
+                return int(cands[min(select, len(cands) - 1)])
+            select = int(np.argmax(self._fallback_choice(choice, orig) *
+                                   unvisited))
+        else:
+            cum_probs = np.cumsum(choice[orig] * unvisited)
+            select = int(np.searchsorted(cum_probs, rnd_num * cum_probs[-1],
+                                         side='right'))
+        if select >= len(unvisited) or not unvisited[select]:
+            # Only if all the remaining probabilities vanish
+            select = int(np.argmax(unvisited))
+        return select
+
+    def _fallback_choice(self, choice, orig):
+        """
+        Return the values used to pick the next city from orig (a city or an
+        array of them) when all its candidates have been visited: its row of
+        the choice information, or of the heuristics in sparse mode, where
+        there is no pheromone for the arcs outside the candidate lists
+        """
+        if self._sparse_ph:
+            return self._heuristics[orig]
+        return choice[orig]
+
+    def _build_colony(self):
+        """
+        Build the tours of all the ants for an iteration, along with their
+        costs, in the pool of workers if there is one
+        """
+        if self._ant_pool is not None:
+            # The workers read the choice information, make sure it is there
+            self._choice_info()
+            tours, costs = self._ant_pool.build(self._num_ants)
+        else:
+            tours, costs = self._construct_ants(self._num_ants)
+        return tours.tolist(), costs.tolist()
+
+    def _construct_ants(self, num_ants):
+        """
+        Build the tours of num_ants ants, one after the other or all at once
+        (see batch_ants), and return the array of tours (one per row) and the
+        array of their costs
+        """
+        if self._batch_ants:
+            return self._construct_colony(num_ants)
+        ants = [self._construct_ant() for _ in range(num_ants)]
+        return (np.array([tour for tour, _ in ants]),
+                np.array([cost for _, cost in ants]))
+
+    def _construct_colony(self, num_ants):
+        """
+        Build the tours of num_ants ants at once, and return the array of tours
+        (one per row) and the array of their costs
+
+        The colony advances one step at a time: the rows of the choice
+        information matrix for the current city of every ant are gathered into
+        a num_ants-by-n matrix (num_ants-by-k with candidate lists), masked
+        with the unvisited cities of each ant, and the next city of every ant
+        is drawn in a single roulette over the cumulative sums of the rows.
+        The selection rules are the same as in _next_city.
+        """
+        n = self._sol_length
+        choice = self._choice_info()
+        rows = np.arange(num_ants)
+        tours = np.zeros((num_ants, n), dtype=np.intp)
+        unvisited = np.ones((num_ants, n))
+        unvisited[:, 0] = 0
+        costs = np.zeros(num_ants, dtype=self._cm.dtype)
+        orig = tours[:, 0].copy()
+        for step in range(1, n):
+            rnd_nums = self._np_random.random(num_ants)
+            if self._candidates is not None:
+                cands = self._candidates[orig]
+                if self._sparse_ph:
+                    cand_choice = choice[orig]
+                else:
+                    cand_choice = choice[orig[:, np.newaxis], cands]
+                probs = cand_choice * unvisited[rows[:, np.newaxis], cands]
+            else:
+                probs = choice[orig] * unvisited
+            cum_probs = np.cumsum(probs, axis=1)
+            pvals = rnd_nums * cum_probs[:, -1]
+            # Position of the first cumulative value over each random value
+            select = (cum_probs <= pvals[:, np.newaxis]).sum(axis=1)
+            select = np.minimum(select, probs.shape[1] - 1)
+            if self._candidates is not None:
+                select = cands[rows, select]
+                # Ants with all their candidates visited take the best
+                # remaining city
+                exhausted = cum_probs[:, -1] <= 0
+                if exhausted.any():
+                    select[exhausted] = np.argmax(
+                        self._fallback_choice(choice, orig[exhausted]) *
+                        unvisited[exhausted], axis=1)
+            # Only if all the remaining probabilities of an ant vanish
+            stuck = unvisited[rows, select] == 0
+            if stuck.any():
+                select[stuck] = np.argmax(unvisited[stuck], axis=1)
+            tours[:, step] = select
+            unvisited[rows, select] = 0
+            costs += self._cm[orig, select]
+            orig = select
+        costs += self._cm[orig, 0]
+        return tours, costs
 
     def _fitness(self, indiv):
         """
@@ -138,27 +385,68 @@ class aco_tsp(aco):
         cost = sum(self._cost_matrix[o][d] for (o,d) in arcs)
         return cost
 
+    def _improve(self, pop):
+        """
+        Improve the best ls_top_k ants with the local search, if there is one,
+        and rank them again
+        """
+        if self._local_search is None:
+            return pop
+        top = min(self._ls_top_k, len(pop))
+        tours, costs = self._local_search.improve_batch(
+            [sol for sol, _ in pop[:top]], [fit for _, fit in pop[:top]])
+        improved = list(zip(tours, costs)) + pop[top:]
+        improved.sort(key=operator.itemgetter(1))
+        return improved
+
+    def _cache_keys(self, pop):
+        """
+        Return the list of keys identifying each tour in the fitness cache: a
+        64 bit hash of the permutation, rotated to start with city 0
+        """
+        return self._tour_hash(pop).tolist()
+
+    def _distance(self, sols1, sols2):
+        """
+        Return the distance between each pair of tours: the fraction of the
+        arcs of the first one not in the second one
+        """
+        return arc_distance(sols1, sols2)
+
     def _update_ph(self, pop):
         """
         Update the pheromone matrix for each (sol, fitness) tuple in population
 
         The update is by 1 /(1 + fitness) to avoid problems with division by
-        zero.
+        zero, relative to the evaporation scale factor. The choice information
+        is refreshed just for the arcs updated. In sparse mode, the arcs outside
+        the candidate lists are skipped.
         """
         for sol, fit in pop[:self._num_ants_ph]:
-            ph = 1.0 / (1 + fit)
-            for s in range(self._sol_length-1):
-                self._pheromones[sol[s]][sol[s+1]] += ph
-            self._pheromones[sol[self._sol_length-1]][sol[0]] += ph
+            ph = 1.0 / (1 + fit) / self._ph_scale
+            # Arcs from each city to the next one, closing the tour
+            rows = np.asarray(sol)
+            cols = np.roll(rows, -1)
+            if self._sparse_ph:
+                # Position of each successor in the candidate list
+                match = self._candidates[rows] == cols[:, np.newaxis]
+                stored = match.any(axis=1)
+                rows = rows[stored]
+                cols = match[stored].argmax(axis=1)
+            self._pheromones[rows, cols] += ph
+            if self._choice is not None:
+                self._choice[rows, cols] = (self._pheromones[rows, cols] **
+                                            self._alpha *
+                                            self._heur_beta[rows, cols])
 
-    def _evaporate(self):
+    def _renormalize_ph(self):
         """
-        Apply evaporation
+        Apply the accumulated evaporation scale factor to the stored pheromone
+        values and reset it
         """
-
-        for s in range(self._sol_length):
-            for p in range(self._sol_length):
-                self._pheromones[s][p] *= self._evaporation
+        self._pheromones *= self._ph_scale
+        self._ph_scale = 1.0
+        self._choice = None
 
 
 if __name__ == "__main__":
@@ -176,4 +464,4 @@ if __name__ == "__main__":
     myaco = aco_tsp(cm, max_iter=max_it)
     myaco._run()
     print(myaco._best_sol, myaco._best_obj)
-    print(myaco._pheromones)
+    print(myaco.pheromones())
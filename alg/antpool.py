@@ -0,0 +1,107 @@
+"""
+Parallel ant construction for ENDOF (Endof New Distributed Optimiaztion
+Framework)
+
+Process pool to build the ants of each iteration of a colony on several cores,
+so that a multi-core node can run a single instance (e.g. one MPI process per
+node instead of one per core).
+
+The choice information matrix, the only data needed for the construction that
+changes between iterations, is kept in a shared memory block: the colony
+writes it in place, and the workers read it without any copy. The rest of the
+colony is copied once to each worker when the pool starts. Each chunk of ants
+gets its own random stream, spawned from a seed sequence owned by the pool, so
+that runs are repeatable regardless of the worker that builds each chunk.
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+
+# State of each worker process: its copy of the colony and the shared block
+_worker = {}
+
+
+def _init_worker(colony, shm_name, shape, dtype):
+    """
+    Initialize a worker process with a copy of the colony reading the choice
+    information from the shared memory block
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    colony._choice = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    _worker['colony'] = colony
+    _worker['shm'] = shm
+
+
+def _build_ants(task):
+    """
+    Build a chunk of ants in a worker process, with its own random stream
+
+    Return the tours as a compact integer array (one per row) and their costs.
+    """
+    num_ants, seed_seq = task
+    colony = _worker['colony']
+    colony._np_random = np.random.default_rng(seed_seq)
+    tours, costs = colony._construct_ants(num_ants)
+    return tours.astype(np.min_scalar_type(colony._sol_length)), costs
+
+
+class ant_pool():
+    """
+    Pool of worker processes building the ants of a colony (e.g. aco_tsp)
+
+    The colony must provide _construct_ants(num_ants), returning the tours and
+    costs as arrays, and read the choice information from its _choice
+    attribute, which is replaced by the shared block in the workers (see
+    choice_buffer).
+    """
+    def __init__(self, colony, num_workers, shape, dtype, seed):
+        """
+        Start the pool:
+        - Colony, copied to every worker as it is when the pool starts
+        - Number of worker processes
+        - Shape and dtype of the choice information matrix
+        - Seed for the seed sequence of the random streams
+        """
+        dtype = np.dtype(dtype)
+        size = max(1, int(np.prod(shape)) * dtype.itemsize)
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._choice = np.ndarray(shape, dtype=dtype, buffer=self._shm.buf)
+        self._num_workers = num_workers
+        self._seed_seq = np.random.SeedSequence(seed)
+        self._pool = multiprocessing.Pool(
+            num_workers, _init_worker, (colony, self._shm.name, shape, dtype))
+
+    def choice_buffer(self):
+        """
+        Return the choice information matrix in shared memory, to be written
+        in place by the colony
+        """
+        return self._choice
+
+    def build(self, num_ants):
+        """
+        Build num_ants ants, split in one chunk per worker, and return the
+        arrays of tours (one per row) and costs
+        """
+        chunks = [len(chunk) for chunk in
+                  np.array_split(np.arange(num_ants), self._num_workers)
+                  if len(chunk)]
+        seeds = self._seed_seq.spawn(len(chunks))
+        results = self._pool.map(_build_ants, list(zip(chunks, seeds)))
+        tours = np.concatenate([tours for tours, _ in results])
+        costs = np.concatenate([costs for _, costs in results])
+        return tours, costs
+
+    def close(self):
+        """
+        Stop the workers and release the shared memory block
+        """
+        self._pool.terminate()
+        self._pool.join()
+        self._choice = None
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,70 @@
+"""
+Candidate lists for ENDOF (Endof New Distributed Optimiaztion Framework)
+
+Nearest neighbour lists for problems defined over a matrix of arc values (e.g.
+the cost matrix of a TSP), used to restrict the moves or choices considered at
+each element to the most promising ones. There is also a base class for the
+classes that look up single values of such a matrix in their inner loops.
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+import numpy as np
+
+
+def candidate_lists(matrix, k, block_size=1024):
+    """
+    Return an n-by-k integer array with the k columns of smallest value in each
+    row of matrix (excluding the diagonal), sorted by value
+
+    For a cost matrix, row a holds the k cheapest successors of a; for the
+    transposed cost matrix, the k cheapest predecessors. Pass the negated
+    matrix to get the largest values instead (e.g. for heuristics).
+
+    The rows are processed in blocks of block_size, so only a block is copied
+    at a time (the matrix may be shared among processes, see mpi_multirun).
+    """
+    matrix = np.asarray(matrix)
+    n = len(matrix)
+    k = min(k, n - 1)
+    cands = np.empty((n, k), dtype=np.intp)
+    for start in range(0, n, block_size):
+        values = np.array(matrix[start:start + block_size], dtype=float)
+        rows = np.arange(len(values))
+        values[rows, start + rows] = np.inf
+        # Only the k best of each row need to be sorted
+        block = np.argpartition(values, k - 1, axis=1)[:, :k]
+        order = np.argsort(np.take_along_axis(values, block, axis=1), axis=1,
+                           kind='stable')
+        cands[start:start + len(values)] = np.take_along_axis(block, order,
+                                                              axis=1)
+    return cands
+
+
+class cost_lookup():
+    """
+    Base class for fast lookups of single arc costs in self._cost
+
+    The cost matrix is kept as a memoryview, which gives fast scalar lookups
+    (as plain ints) without a copy of the matrix, which may be shared among
+    processes (see mpi_multirun). Memoryviews cannot be pickled, so the matrix
+    is pickled as an array instead (e.g. when a local_search is sent to the
+    worker processes of an ant_pool).
+    """
+    def _set_cost_matrix(self, cost_matrix):
+        """
+        Keep a view of cost_matrix in self._cost, and return it as a
+        contiguous array (for vectorized work, like the candidate lists)
+        """
+        cm = np.ascontiguousarray(cost_matrix)
+        self._cost = memoryview(cm)
+        return cm
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cost'] = np.asarray(self._cost)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cost = memoryview(self._cost)
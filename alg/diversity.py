@@ -0,0 +1,58 @@
+"""
+Population diversity for ENDOF (Endof New Distributed Optimiaztion Framework)
+
+Helpers to suppress duplicate solutions in the populations of the algorithms
+and to measure how diverse they are: the fraction of unique solutions and the
+mean distance between pairs of solutions, estimated over a random sample of
+pairs.
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+import numpy as np
+
+
+def first_occurrences(keys):
+    """
+    Return the list of the positions of the first occurrence of each distinct
+    key, in order
+    """
+    seen = set()
+    positions = []
+    for pos, key in enumerate(keys):
+        if key not in seen:
+            seen.add(key)
+            positions.append(pos)
+    return positions
+
+
+def sample_pairs(num, num_pairs, rng):
+    """
+    Return two arrays with the positions (first, second) of pairs of different
+    elements out of num: all the pairs if there are no more than num_pairs,
+    or num_pairs pairs drawn at random with rng (a numpy random generator)
+    """
+    if num < 2:
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    if num * (num - 1) // 2 <= num_pairs:
+        return np.triu_indices(num, 1)
+    first = rng.integers(0, num, size=num_pairs)
+    second = rng.integers(0, num - 1, size=num_pairs)
+    second += second >= first
+    return first, second
+
+
+def arc_distance(tours1, tours2):
+    """
+    Return, for each pair of closed tours (rows of tours1 and tours2), the
+    fraction of the arcs of the first one that are not in the second one
+    """
+    tours1 = np.asarray(tours1)
+    tours2 = np.asarray(tours2)
+    num, n = tours1.shape
+    rows = np.arange(num)[:, np.newaxis]
+    # Successor of each city in the tours of the second set
+    succ2 = np.empty_like(tours2)
+    succ2[rows, tours2] = np.roll(tours2, -1, axis=1)
+    shared = succ2[rows, tours1] == np.roll(tours1, -1, axis=1)
+    return 1 - shared.sum(axis=1) / float(n)
@@ -0,0 +1,182 @@
+"""
+Edge assembly crossover for ENDOF (Endof New Distributed Optimiaztion Framework)
+
+EAX (Nagata) for directed tours, as used for the asymmetric TSP. Unlike order
+based crossovers, it works on the arcs of the parents, so the child is made
+almost entirely of arcs inherited from one of them:
+- The union of the arcs of parents A and B is split into AB-cycles, which
+  alternate arcs of A (traversed forward) and arcs of B (traversed backward).
+  In a directed tour every city has one outgoing arc in A and one incoming arc
+  in B, so the AB-cycles are just the cycles of the permutation
+  u -> pred_B(succ_A(u)), and arcs common to both parents give the trivial
+  ones (fixed points).
+- An intermediate solution is built from A by replacing the arcs of A in an
+  AB-cycle (the E-set) with those of B. Every city keeps one successor and one
+  predecessor, so the result is a set of directed sub-tours.
+- The sub-tours are merged greedily, the smallest one first, into the one
+  giving the cheapest exchange of two arcs (a, a'), (b, b') for (a, b'),
+  (b, a'), with b' among the cheapest successors of a (all the cities only if
+  none of them is in another sub-tour). This keeps the direction of both.
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+from candidates import candidate_lists, cost_lookup
+
+
+class eax(cost_lookup):
+    """
+    Edge assembly crossover for directed tours, with single AB-cycle E-sets
+    """
+    def __init__(self, cost_matrix, num_neighbours=10, num_trials=5):
+        """
+        Initialization of the crossover:
+        - Cost matrix, where cost_matrix[a][b] is the cost of the arc from a to
+          b (not assumed to be symmetric)
+        - Number of neighbours in the candidate lists used to merge sub-tours
+        - Number of trials: number of AB-cycles (E-sets) tried for each pair of
+          parents, keeping the best resulting child
+        """
+        cm = self._set_cost_matrix(cost_matrix)
+        self._succ_cands = candidate_lists(cm, num_neighbours).tolist()
+        self._num_trials = num_trials
+
+    def cross(self, parent_a, parent_b, rng):
+        """
+        Build a child from parents A and B (sequences of cities), using rng
+        (a numpy random generator) to choose the AB-cycles
+
+        Return the child tour (a list starting with the first city of A) and
+        its cost. If the parents have the same arcs, the child is A.
+        """
+        cost = self._cost
+        tour_a = list(parent_a)
+        n = len(tour_a)
+        succ_a = [0] * n
+        pred_b = [0] * n
+        for prev, city in zip(tour_a, tour_a[1:] + tour_a[:1]):
+            succ_a[prev] = city
+        tour_b = list(parent_b)
+        for prev, city in zip(tour_b, tour_b[1:] + tour_b[:1]):
+            pred_b[city] = prev
+        cost_a = sum(cost[city, succ_a[city]] for city in tour_a)
+
+        cycles = self._ab_cycles(succ_a, pred_b)
+        if not cycles:
+            return tour_a, cost_a
+        best = None
+        num_trials = min(self._num_trials, len(cycles))
+        for idx in rng.choice(len(cycles), size=num_trials, replace=False):
+            succ, child_cost = self._apply_eset(succ_a, pred_b,
+                                                cycles[idx], cost_a)
+            child_cost = self._merge_subtours(succ, child_cost)
+            if best is None or child_cost < best[1]:
+                best = succ, child_cost
+        succ, child_cost = best
+        child = [tour_a[0]]
+        for _ in range(n - 1):
+            child.append(succ[child[-1]])
+        return child, child_cost
+
+    def _ab_cycles(self, succ_a, pred_b):
+        """
+        Return the list of non trivial AB-cycles, each one as the list of the
+        cities u whose arc of A (u, succ_A(u)) is in it; the arc of B in it
+        that follows is (pred_B(succ_A(u)), succ_A(u))
+        """
+        n = len(succ_a)
+        visited = [False] * n
+        cycles = []
+        for start in range(n):
+            if visited[start]:
+                continue
+            cycle = []
+            city = start
+            while not visited[city]:
+                visited[city] = True
+                cycle.append(city)
+                city = pred_b[succ_a[city]]
+            if len(cycle) > 1:
+                cycles.append(cycle)
+        return cycles
+
+    def _apply_eset(self, succ_a, pred_b, cycle, cost_a):
+        """
+        Replace the arcs of A in the AB-cycle with those of B, and return the
+        resulting successor of each city and the total cost of the arcs
+        """
+        cost = self._cost
+        succ = succ_a[:]
+        for city in cycle:
+            dest = succ_a[city]
+            orig = pred_b[dest]
+            succ[orig] = dest
+            cost_a += cost[orig, dest] - cost[city, dest]
+        return succ, cost_a
+
+    def _merge_subtours(self, succ, total_cost):
+        """
+        Merge the sub-tours given by the successor of each city into a single
+        tour, in place, and return its cost
+        """
+        cost = self._cost
+        n = len(succ)
+        pred = [0] * n
+        for city, dest in enumerate(succ):
+            pred[dest] = city
+        # Label the sub-tours
+        label = [-1] * n
+        members = {}
+        for start in range(n):
+            if label[start] >= 0:
+                continue
+            cities = []
+            city = start
+            while label[city] < 0:
+                label[city] = start
+                cities.append(city)
+                city = succ[city]
+            members[start] = cities
+        while len(members) > 1:
+            sub = min(members, key=lambda key: len(members[key]))
+            move = self._best_merge(members[sub], sub, succ, pred, label)
+            if move is None:
+                move = self._best_merge(members[sub], sub, succ, pred, label,
+                                        range(n))
+            delta, a, b_next = move
+            b = pred[b_next]
+            a_next = succ[a]
+            succ[a], succ[b] = b_next, a_next
+            pred[b_next], pred[a_next] = a, b
+            total_cost += delta
+            # Relabel the smaller sub-tour
+            other = label[b_next]
+            for city in members[sub]:
+                label[city] = other
+            members[other].extend(members.pop(sub))
+        return total_cost
+
+    def _best_merge(self, cities, sub, succ, pred, label, dests=None):
+        """
+        Find the cheapest exchange of arcs merging the sub-tour with the given
+        cities (and label sub) with another one: (a, a'), (b, b') replaced by
+        (a, b'), (b, a'), with a in the sub-tour and b' outside of it, among
+        the candidates of a (or dests, if provided)
+
+        Return a tuple (delta of cost, a, b') or None if there is none.
+        """
+        cost = self._cost
+        best = None
+        for a in cities:
+            a_next = succ[a]
+            base = cost[a, a_next]
+            options = self._succ_cands[a] if dests is None else dests
+            for b_next in options:
+                if label[b_next] == sub:
+                    continue
+                b = pred[b_next]
+                delta = (cost[a, b_next] + cost[b, a_next] - base -
+                         cost[b, b_next])
+                if best is None or delta < best[0]:
+                    best = delta, a, b_next
+        return best
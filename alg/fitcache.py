@@ -0,0 +1,107 @@
+"""
+Fitness cache for ENDOF (Endof New Distributed Optimiaztion Framework)
+
+Memoization of fitness values for the population based algorithms, so that
+individuals that show up again (elites, solutions received from other
+instances, duplicate children) are not evaluated again.
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+from collections import OrderedDict
+import numpy as np
+
+
+class tour_hash():
+    """
+    Cheap 64 bit hash for permutations of a fixed size
+
+    The hash of a tour t is sum(keys[t[i]] * mult^i) modulo 2^64, where keys is
+    a table of random 64 bit values, one per element, and mult is a random odd
+    multiplier. It depends on both the elements and their positions, needs
+    O(n) memory, and is computed for a whole matrix of tours (one per row) with
+    a couple of vectorized operations.
+
+    If rotations is True, each tour is rotated to start with city 0 before
+    being hashed, so that all the rotations of a closed tour (which are the
+    same solution) get the same hash.
+    """
+    def __init__(self, size, seed=0, rotations=False):
+        self._rotations = rotations
+        rng = np.random.default_rng(seed)
+        self._keys = rng.integers(0, 2**63, size=size, dtype=np.uint64)
+        mult = int(rng.integers(0, 2**62)) * 2 + 1
+        powers = [1]
+        for _ in range(1, size):
+            powers.append(powers[-1] * mult % 2**64)
+        self._powers = np.array(powers, dtype=np.uint64)
+
+    def __call__(self, tours):
+        """
+        Return an array with the hash of each tour (row) in tours
+        """
+        tours = np.asarray(tours).reshape(-1, len(self._keys))
+        if self._rotations:
+            size = len(self._keys)
+            starts = np.argmin(tours, axis=1)
+            shifted = (np.arange(size) + starts[:, np.newaxis]) % size
+            tours = np.take_along_axis(tours, shifted, axis=1)
+        # Unsigned integer arithmetic wraps around, which is the modulo 2^64
+        return (self._keys[tours] * self._powers).sum(axis=1, dtype=np.uint64)
+
+
+class fitness_cache():
+    """
+    Bounded fitness cache with least recently used eviction
+
+    Values are stored by key (any hashable, typically a hash of the
+    individual). When the capacity is exceeded, the entries that have not been
+    used for the longest time are discarded. The number of hits and misses is
+    recorded to assess the savings in evaluations.
+    """
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, keys):
+        """
+        Look up the values for a sequence of keys
+
+        Return a list with the cached value for each key (None if missing) and
+        the list of positions of the missing ones.
+        """
+        values = []
+        missing = []
+        for pos, key in enumerate(keys):
+            value = self._entries.get(key)
+            if value is None:
+                missing.append(pos)
+            else:
+                self._entries.move_to_end(key)
+            values.append(value)
+        self.misses += len(missing)
+        self.hits += len(values) - len(missing)
+        return values, missing
+
+    def store(self, keys, values):
+        """
+        Store the values for a sequence of keys, evicting the least recently
+        used entries if needed
+        """
+        for key, value in zip(keys, values):
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+        while len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Return a dictionary with the number of hits, misses and stored entries
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries)}
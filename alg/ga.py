@@ -2,7 +2,9 @@
 Genetic Algorithm class for ENDOF (Endof New Distributed Optimiaztion Framework)
 
 Includes the base class for genetic algorithms, with a basic binary gene
-representation and simple random crossover and mutation operations.
+representation and simple random crossover and mutation operations. The genes
+of each individual are packed into 64 bit words, so that the operations work on
+whole words for the whole population at once.
 
 Copyright Diego Diaz Fidalgo 2014/07/27
 
@@ -11,7 +13,79 @@ This file is distributed under the MIT license (http://opensource.org/licenses/M
 
 import random
 import math
-import operator
+import numpy as np
+from fitcache import fitness_cache
+from selection import roulette, tournament
+from stopping import max_iterations, first_fired
+from diversity import first_occurrences, sample_pairs
+
+
+# Bits in each word of the packed binary representation
+WORD_BITS = 64
+ALL_ONES = np.uint64(2**64 - 1)
+
+
+def _popcount(words):
+    """
+    Return the number of bits set in each row of an array of uint64 words
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+    # Older numpy: count the bits of each byte
+    as_bytes = np.ascontiguousarray(words).view(np.uint8)
+    return np.unpackbits(as_bytes, axis=-1).sum(axis=-1, dtype=np.int64)
+
+
+class population():
+    """
+    Compact population storage
+
+    The individuals are kept as the rows of an array (indivs) and their fitness
+    values in a separate vector (fitness), in the same order. indivs is
+    usually a contiguous 2D matrix, one individual per row (the packed words
+    of the base GA, or the permutations of the TSP); for scalar representations
+    it can be a 1D array.
+
+    Indexing with an integer returns an (individual, fitness) tuple, while
+    slices or index arrays return a new population with the selected rows, so
+    the ranked population can still be used as a sorted list of tuples.
+
+    The rows are ranked (best first) unless order is given: then they are in
+    no particular order, and order holds their positions best first. This is
+    used to replace a few individuals in place, without moving the rest.
+    """
+    def __init__(self, indivs, fitness, order=None):
+        self.indivs = indivs
+        self.fitness = fitness
+        self.order = order
+
+    def __len__(self):
+        return len(self.fitness)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return self.indivs[idx], self.fitness[idx]
+        return population(self.indivs[idx], self.fitness[idx])
+
+    def __iter__(self):
+        return zip(self.indivs, self.fitness)
+
+    def ranking(self):
+        """
+        Return the positions of the rows, best first
+        """
+        if self.order is None:
+            return np.arange(len(self))
+        return self.order
+
+    def best(self):
+        """
+        Return the first (best, if ranked) individual and its fitness as plain
+        python values, not tied to the storage of the population
+        """
+        first = 0 if self.order is None else int(self.order[0])
+        return (self.indivs[first:first + 1].tolist()[0],
+                self.fitness[first:first + 1].tolist()[0])
 
 
 class ga():
@@ -20,7 +94,9 @@ class ga():
     """
     def __init__(self, num_genes, pop_size=50, elitism=0, crossover_prob=0.5,
                  mutation_prob=0.05, max_iter=1000, rand_seed=None,
-                 rand_offset=0):
+                 rand_offset=0, cache_size=0, stop_criteria=None,
+                 selection="roulette", tournament_size=2, steady_state=0,
+                 suppress_duplicates=True):
         """
         Initialization of the GA:
         The following parametres are needed (defaults will be used if no
@@ -33,9 +109,26 @@ class ga():
         - Maximum number of iterations
         - Random Seed: a seed can be provided to replicate a result; if no seed
           is provided, the rng is initialized in the standard fashion
-        - Random Offset: If a number > 0 is provided, the state of the rng will
-          be advanced by that quantity (useful for parallel runs with
-          deterministic seeds by providing a different offset for each instance)
+        - Random Offset: If a number > 0 is provided along with a seed, the
+          rng is seeded from both, so each offset gives a different stream
+          (useful for parallel runs with deterministic seeds by providing a
+          different offset for each instance)
+        - Cache Size: maximum number of fitness values to keep in a cache to
+          avoid evaluating again individuals already seen (least recently used
+          values are discarded first); 0 disables the cache
+        - Stop Criteria: additional end conditions (see the stopping module),
+          checked after the maximum number of iterations; the name of the one
+          that ends the run is kept in _stop_reason
+        - Selection: "roulette" to select individuals with probability
+          proportional to 1 / (fitness + 1), or "tournament" to take the best
+          of tournament_size random individuals (see the selection module)
+        - Tournament Size: number of individuals in each tournament
+        - Steady State: if > 0, each iteration is a step that only replaces
+          (at most) this number of the worst individuals of the population,
+          instead of a whole generation (see _steady_state_step)
+        - Suppress Duplicates: if True, only one copy of each individual is
+          kept when ranking (see _rank_pop), so that the places in the
+          population go to different individuals
         Additionally, the GA is reset by instantiating an empty population
         and setting the best solution and fitness value to None, and
         zeroing the iteration counter
@@ -51,53 +144,129 @@ class ga():
         self._crossover_prob = crossover_prob
         self._mutation_prob = mutation_prob
         self._max_iter = max_iter
+        self._stop_criteria = [max_iterations(max_iter)]
+        if stop_criteria:
+            self._stop_criteria.extend(stop_criteria)
+        self._stop_reason = None
+        if selection not in ("roulette", "tournament"):
+            raise ValueError("Unknown selection: {}".format(selection))
+        self._selection = selection
+        self._tournament_size = tournament_size
+        self._steady_state = steady_state
+        self._suppress_duplicates = suppress_duplicates
+        # Fraction of unique individuals among those last ranked
+        self._unique_fraction = 1.0
         self._random = random.Random()
+        if rand_offset and rand_seed is not None:
+            # Strings are hashed into the whole state of the rng
+            rand_seed = "{}/{}".format(rand_seed, rand_offset)
         self._random.seed(rand_seed)
-        if rand_offset:
-            self._random.jumpahead(rand_offset)
+        # Vectorized operations draw their random numbers in bulk from a numpy
+        # generator, seeded from the main rng so that runs remain repeatable
+        self._np_random = np.random.default_rng(self._random.getrandbits(64))
         # Incoming population: if exists, add to the self-generated population
         self._incoming_population = []
+        # Fitness cache, only if a capacity is provided
+        self._cache = fitness_cache(cache_size) if cache_size else None
 
 
     def initialize_population(self):
         """
         Initialize the poulation
 
-        Create a random initial population for the GA. This generates an integer
-        in the right range for each individual. The integers will actually be
-        interpreted as bit arrays.
+        Create a random initial population for the GA. This generates random
+        bits for each individual, packed into num_words 64 bit words: gene i is
+        bit i % 64 of word i // 64, and the bits of the last word beyond the
+        number of genes are always 0.
 
         Override this method to generate a suitable population for a different
         representation
         """
-        # Convert number of genes to the largest integer under the binary
-        # representation with that number of bits.
-        # Do this here instead of in self.__init__() because this is specific to
-        # the representation, and this method should be overridden when
-        # subclassing
-        self._indiv_size = pow(2, self._num_genes) - 1
-        pop = [self._random.randint(0, self._indiv_size) for _ in
-               range(self._pop_size)]
+        # Set the packing here instead of in self.__init__() because this is
+        # specific to the representation, and this method should be overridden
+        # when subclassing
+        self._num_words = -(-self._num_genes // WORD_BITS)
+        tail_bits = self._num_genes - (self._num_words - 1) * WORD_BITS
+        self._last_word_mask = np.uint64(2**tail_bits - 1)
+        pop = self._np_random.integers(0, ALL_ONES, endpoint=True,
+                                       size=(self._pop_size, self._num_words),
+                                       dtype=np.uint64)
+        pop[:, -1] &= self._last_word_mask
         self._pop = self._rank_pop(pop)
     
-    def _rank_pop(self, pop):
+    def _as_array(self, pop):
+        """
+        Convert a sequence of individuals into the array used to store them in
+        a population
+
+        For the binary representation each individual is a row of num_words
+        64 bit words (e.g. the list of words of a solution received from
+        another instance).
+
+        Override this method to use a suitable array layout for a different
+        representation
+        """
+        return np.asarray(pop, dtype=np.uint64).reshape(-1, self._num_words)
+
+    def _genes(self, indivs):
+        """
+        Unpack an array of individuals into a matrix of genes (one row of
+        num_genes 0/1 values per individual), e.g. to compute the fitness of
+        a binary problem as a dot product with a vector of weights
+        """
+        as_bytes = np.ascontiguousarray(indivs, dtype='<u8').view(np.uint8)
+        bits = np.unpackbits(as_bytes, axis=-1, bitorder='little')
+        return bits[..., :self._num_genes]
+    
+    def _rank_pop(self, pop, fitness=None, known=None, size=None):
         """
         Rank a population based on the fitness value
         
-        Return a list of tuples (individual, fitness) sorted by fitness in
-        ascending order.
+        Return a population with the individuals sorted by fitness in ascending
+        order, truncated to size (pop_size if not provided).
         
         The individuals for the population are those provided in pop.
+        Optionally, fitness provides the values already known for them (e.g.
+        carried over, or calculated incrementally by the mutation), in which
+        case known is a boolean mask of the entries that are valid, or None if
+        all of them are. Only the individuals without a known value are
+        evaluated.
+
+        The fraction of unique individuals (as identified by _cache_keys) is
+        recorded (see diversity), and if duplicate suppression is enabled, only
+        the first copy of each one is kept, before evaluating them. The
+        population can then be smaller than size (see _refill).
+        
+        Only the best size fitness values need to be ordered, so they are found
+        by partitioning the fitness vector, and just that part is sorted.
         
         Override this method to provide a diffrent ranking mechanism
         (e.g. for maximization or for multiobjective)
         """
-        decorated_pop = zip(pop, map(self._fitness, pop))
-        decorated_pop.sort(key=operator.itemgetter(1))
-        if len(decorated_pop) > self._pop_size:
-            return decorated_pop[:self._pop_size]
+        indivs = self._as_array(pop)
+        if size is None:
+            size = self._pop_size
+        if len(indivs):
+            keep = first_occurrences(self._cache_keys(indivs))
+            self._unique_fraction = len(keep) / float(len(indivs))
+            if self._suppress_duplicates and len(keep) < len(indivs):
+                indivs = indivs[keep]
+                if fitness is not None:
+                    fitness = np.asarray(fitness)[keep]
+                if known is not None:
+                    known = known[keep]
+        if fitness is None:
+            fitness = self._evaluate(indivs)
+        elif known is not None and not known.all():
+            fitness = np.array(fitness)
+            fitness[~known] = self._evaluate(indivs[~known])
+        if len(fitness) > size:
+            top = np.argpartition(fitness, size - 1)
+            top = top[:size]
+            top = top[np.argsort(fitness[top], kind='stable')]
         else:
-            return decorated_pop
+            top = np.argsort(fitness, kind='stable')
+        return population(indivs[top], fitness[top])
     
     def _crossover(self, parent1, parent2):
         """
@@ -105,84 +274,60 @@ class ga():
         
         Given two parent individuals, generate a new one containing the upper
         bits of parent1 and the lower bits of parent2. The splitting point is
-        randomly generated.
+        randomly generated (see _crossover_batch).
         
         Override this method to generate a suitable crossover operation for a
         different representation
         """
-        # The limits for randint are defined so that at least one element from
-        # each parent remains: at the lowest the split will be at position 1,
-        # and at the highest at n-1 for n bits (indiv_size = 2^n - 1)
-        split_bit = \
-            math.floor(math.log(self._random.randint(2, self._indiv_size), 2))
-        split_lower_mask = int(pow(2, split_bit) - 1)
-        split_upper_mask = self._indiv_size - split_lower_mask
-        return (parent1 & split_upper_mask) + (parent2 & split_lower_mask)
+        return self._crossover_batch(parent1[np.newaxis],
+                                     parent2[np.newaxis])[0]
+    
+    def _crossover_batch(self, parents1, parents2):
+        """
+        Batch crossover operation
+        
+        Given two arrays of parents, return the array of children resulting
+        from the crossover of each pair (parents1[i], parents2[i]).
+        
+        For the binary representation this is a one-point crossover of the
+        whole batch: a split point is drawn for each child, so that at least
+        one gene comes from each parent, and a mask with the genes below it
+        set is built for all the words of all the children at once. Children
+        take the masked bits from parents2 and the rest from parents1.
+
+        Override this method for a different representation (by default it
+        is also used by _crossover)
+        """
+        num_children = len(parents1)
+        splits = self._np_random.integers(1, max(2, self._num_genes),
+                                          size=num_children)
+        split_words = (splits // WORD_BITS)[:, np.newaxis]
+        split_bits = (splits % WORD_BITS).astype(np.uint64)[:, np.newaxis]
+        words = np.arange(self._num_words)
+        partial = (np.uint64(1) << split_bits) - np.uint64(1)
+        lower_mask = np.where(words < split_words, ALL_ONES,
+                              np.where(words == split_words, partial,
+                                       np.uint64(0)))
+        return (parents1 & ~lower_mask) | (parents2 & lower_mask)
     
     def _apply_crossover(self, pop):
         """
         Application of the crossover operation to the selected parents.
         
-        The probability of selection for an element in the provided population
-        is proportional to the inverse of its fitness plus one (to avoid
-        problems with division by zero).
+        The pairs of parents are drawn from the provided population with the
+        selection engine (see _selector). The second parent of each pair is
+        selected in the same way, excluding the first one.
         
         Override this method to chose a different way to apply crossover.
         """
-        # Probabilities here should strictly be divided by the overall sum, but
-        # instead a random number is generated in U(0, sum).
-        # Probabilities associated to each individual
-        inv_ranks = [1.0 / (indiv[1] + 1) for indiv in pop]
-        # Total probability
-        total_prob = sum(inv_ranks)
-        # Each element is (p_i, i),
-        # where i is an individual and p_i its probability
-        decorated_pop = zip(inv_ranks, pop)
-        
-        children_pop = []
-        for _ in range(self._pop_size):
-            # Random number for the selection of the first parent pval1
-            # The selected individual is the first for which the accumulated
-            # probability is >= the random number
-            pval1 = self._random.uniform(0, total_prob)
-            acc_prob = 0
-            idx1 = 0
-            while decorated_pop[idx1][0] + acc_prob < pval1:
-                acc_prob += decorated_pop[idx1][0]
-                idx1 += 1
-            # The probability accumulator contains the accumulated probability
-            # up to and including idx1 - 1
-            # Remove the part corresponding to the individual at idx1 from the
-            # total and generate the new random number in the new uniform range
-            pval2 = self._random.uniform(0, total_prob - decorated_pop[idx1][0])
-
-            # pval2 > accumulator means that we can skip the individuals before
-            # idx1, and idx1 itself, as we are considering it removed (and is
-            # not included in the total probability). We start from idx1 + 1,
-            # with the existing value in the accumulator, which is equivalent to
-            # the approach used for idx1 with the individual at idx1 removed,
-            # but idx2 will still refer to the index of the selected individual
-            # without actually removing the one at idx1
-            if pval2 > acc_prob:
-                idx2 = idx1 + 1
-            # The new selected individual will appear before idx1, so we can
-            # repeat exactly the same process as for idx1
-            else:
-                acc_prob = 0
-                idx2 = 0
-            # The loop is the same for both conditions, with the updated index
-            # and accumulator
-            while decorated_pop[idx2][0] + acc_prob < pval2:
-                acc_prob += 1
-                idx2 += 1
-
-            # Add the result of the crossover to the list of children
-            # Pass just the individual, not the fitness (the final [0])
-            parent1 = decorated_pop[idx1][1][0]
-            parent2 = decorated_pop[idx2][1][0]
-            children_pop.append(self._crossover(parent1, parent2))
-            children_pop.append(self._crossover(parent2, parent1))
-        return children_pop
+        selector = self._selector(pop.fitness)
+        parents_idx1, parents_idx2 = selector.sample_pairs(self._pop_size)
+
+        # Each pair generates two children, one with each parent as the first
+        # one for the crossover; all of them are built in one batch
+        parents1 = np.concatenate((parents_idx1, parents_idx2))
+        parents2 = np.concatenate((parents_idx2, parents_idx1))
+        return self._crossover_batch(pop.indivs[parents1], pop.indivs[parents2])
     
     
     def _mutation(self, indiv):
@@ -199,7 +344,9 @@ class ga():
         mutation_bit = self._random.randint(0, self._num_genes - 1)
         # And toggle the bit xor-ing a mask of all 0s,
         # except for a 1 at the bit position
-        mask = 1 << mutation_bit
+        mask = np.zeros(self._num_words, dtype=np.uint64)
+        mask[mutation_bit // WORD_BITS] = (np.uint64(1) <<
+                                           np.uint64(mutation_bit % WORD_BITS))
         return indiv ^ mask
     
     def _apply_mutation(self, pop):
@@ -207,15 +354,23 @@ class ga():
         Application of the mutation operation to the selected parents.
         
         Each individual in the passed population is mutated --generating a new
-        individual-- with probability mutation_prob.
+        individual-- with probability mutation_prob. Return a tuple with the
+        array of mutants and their fitness values, or None in place of the
+        latter if they are not known and have to be evaluated.
+
+        For the binary representation all the mutants are built at once, xor-ing
+        the selected individuals with a matrix of bit-flip masks (one random bit
+        set in each row, as in _mutation).
         
         Override this method to chose a different way to apply mutation.
         """
-        offspring = []
-        for indiv in pop:
-            if self._random.random() <= self._mutation_prob:
-                offspring.append(self._mutation(indiv[0]))
-        return offspring
+        mutate = self._np_random.random(len(pop)) <= self._mutation_prob
+        mutants = pop.indivs[mutate]
+        bits = self._np_random.integers(0, self._num_genes, size=len(mutants))
+        masks = np.zeros_like(mutants)
+        masks[np.arange(len(mutants)), bits // WORD_BITS] = (
+            np.uint64(1) << (bits % WORD_BITS).astype(np.uint64))
+        return mutants ^ masks, None
     
     def _fitness(self, indiv):
         """
@@ -224,94 +379,298 @@ class ga():
         Return the fitness value associated to a given individual. Lower values
         are better (fitter), since the assumption is a minimization problem.
         
-        This particular example returns the integer value of the chromosome.
+        This particular example returns the number of genes set to 1.
         
         Override this method to generate a suitable fitness function for a
         different representation
         """
-        return indiv
+        return int(_popcount(indiv))
+    
+    
+    def _fitness_batch(self, pop):
+        """
+        Batch fitness function
+
+        Return the fitness values for all the individuals in pop, in the same
+        order. This is what _rank_pop uses to score a population.
+
+        For the binary representation, the bits of all the words of the
+        population are counted at once, as long as _fitness is the default
+        one; a subclass that only overrides _fitness gets it applied to each
+        individual instead. Override this method along with _fitness for a
+        vectorized version (e.g. as a dot product of _genes with a vector of
+        weights)
+        """
+        if type(self)._fitness is ga._fitness:
+            return _popcount(pop)
+        return np.array([self._fitness(indiv) for indiv in pop])
+    
+    
+    def _evaluate(self, indivs):
+        """
+        Return an array with the fitness values of the individuals in indivs
+
+        If the fitness cache is enabled, the values are looked up there first,
+        and only the individuals not found are evaluated (with _fitness_batch),
+        storing their values in the cache.
+        """
+        if self._cache is None:
+            return np.asarray(self._fitness_batch(indivs))
+        keys = self._cache_keys(indivs)
+        fitness, missing = self._cache.lookup(keys)
+        if missing:
+            missing_fitness = self._fitness_batch(indivs[missing])
+            for pos, fit in zip(missing, missing_fitness):
+                fitness[pos] = fit
+            self._cache.store([keys[pos] for pos in missing], missing_fitness)
+        return np.asarray(fitness)
+    
+    def _cache_keys(self, indivs):
+        """
+        Return the list of keys identifying each individual in the fitness
+        cache
+
+        For the binary representation the bytes of the words are used.
+
+        Override this method to provide cheap keys (e.g. hashes) for a
+        different representation
+        """
+        return [indiv.tobytes() for indiv in indivs]
+    
+    def _distance(self, indivs1, indivs2):
+        """
+        Return the distance between each pair of individuals (rows of indivs1
+        and indivs2) as a fraction: for the binary representation, the
+        fraction of genes that differ
+
+        Override this method to use a suitable distance for a different
+        representation
+        """
+        return _popcount(indivs1 ^ indivs2) / float(self._num_genes)
+
+    def diversity(self, num_pairs=100):
+        """
+        Return the diversity of the population as a dictionary with:
+        - unique_fraction: fraction of unique individuals among those ranked
+          in the last generation (the duplicates are suppressed if enabled)
+        - mean_distance: mean distance (see _distance) between pairs of
+          individuals of the population, estimated over num_pairs random
+          pairs (or all of them, if there are fewer)
+
+        The pairs are drawn with a generator of their own, so that calling it
+        does not change the course of the run.
+        """
+        rng = np.random.default_rng(self._num_iters)
+        first, second = sample_pairs(len(self._pop), num_pairs, rng)
+        if len(first):
+            mean_distance = float(np.mean(self._distance(
+                self._pop.indivs[first], self._pop.indivs[second])))
+        else:
+            mean_distance = 0.0
+        return {"unique_fraction": self._unique_fraction,
+                "mean_distance": mean_distance}
+
+    def cache_stats(self):
+        """
+        Return the counters of the fitness cache (hits, misses and stored
+        entries) as a dictionary, or None if the cache is not enabled
+        """
+        if self._cache is None:
+            return None
+        return self._cache.stats()
+    
+    
+    def _improve(self, pop):
+        """
+        Improvement stage applied to each newly ranked population (e.g. local
+        search on the best individuals, for memetic algorithms)
+
+        Return the resulting population, ranked. This version does nothing.
+
+        Override this method to add an improvement stage for a given problem.
+        """
+        return pop
     
     
     def _end_condition(self):
         """
         Determine whether the algorithm is considered finished.
         
-        The end condition here is number of iterations >= max_iter
+        The end condition here is number of iterations >= max_iter, or any of
+        the additional stop criteria provided. The name of the criterion that
+        fires is recorded in _stop_reason.
         
         Override this method to generate a suitable end condition for a
         different problem or representation
         """
-        return self._num_iters >= self._max_iter
+        self._stop_reason = first_fired(self._stop_criteria, self._num_iters,
+                                        self._best_obj)
+        return self._stop_reason is not None
     
     
+    def _selector(self, fitness):
+        """
+        Return the selection engine for a ranked population with the given
+        fitness values: a roulette with probabilities proportional to the
+        inverse of the fitness plus one (to avoid problems with division by
+        zero), or tournaments, which only depend on the ranking
+        
+        Override this method to define a different selection mechanism.
+        """
+        if self._selection == "tournament":
+            return tournament(len(fitness), self._tournament_size,
+                              self._np_random)
+        return roulette(1.0 / (fitness + 1), self._np_random)
+    
     def _select_parents(self):
         """
         Select the individuals in the population that will breed to generate the
         next one.
         
-        They are selected with probability inverse to their fitness + 1 until a
-        subpopulation of ceil(pop_size * crossover_prob) size has been reached.
+        They are selected with the selection engine (see _selector), without
+        replacement, until a subpopulation of ceil(pop_size * crossover_prob)
+        size has been reached.
         
         The best individual is always included.
         
+        Return the selected individuals as a population (a subset of the
+        current one, still sorted by fitness).
+        
         Override this method to define a different selection mechanism.
         """
-        # decorate with probabilities as 1 / (fitness + 1)
-        candidates = [(1.0 / (indiv[1] + 1), indiv) for indiv in self._pop]
-        selected = []
-        
-        # The best individual is always included
-        # Undecorate to add the (fitness, indiv) tuple
-        selected.append(candidates.pop(0)[1])
+        selector = self._selector(self._pop.fitness)
         
-        # Add the rest to make the selection size
-        # ceil(pop_size * crossover_prob)
+        # The best individual (position 0) is always included, add the rest
+        # to make the selection size ceil(pop_size * crossover_prob) without
+        # replacement
         selection_size = int(math.ceil(self._pop_size * self._crossover_prob))
-        total_prob = sum(x[0] for x in candidates)
-        prob_decrement = 0
-        for _ in range(selection_size - 1):  # There's one already in
-            # Start from 0 and check the accumulated probability for each
-            # individual
-            # The selected individual is the first for which the accumulated
-            # probability is more that the random number generated
-            # The individual is removed (transferred to the selected list) and
-            # the process is repeated. No additional calculations needed since
-            # the individual is removed and the accumulation is done on the fly
-            # in each iteration rather than using the accumulated values in the
-            # decoration
-            total_prob -= prob_decrement
-            pval = self._random.uniform(0, total_prob)
-            acc_prob = 0
-            idx = 0
-            while candidates[idx][0] + acc_prob < pval:
-                acc_prob += candidates[idx][0]
-                idx += 1
-            # Undecorate to add the (indiv, fitness) tuple
-            prob_decrement = candidates[idx][0]
-            selected.append(candidates.pop(idx)[1])
-        return selected
+        selection_size = min(selection_size, len(self._pop))
+        selected = selector.sample_without_replacement(selection_size - 1,
+                                                        exclude=(0,))
+        selected = np.sort(np.concatenate(([0], selected)))
+        return self._pop[selected]
     
-    def _run_iteration(self):
+    
+    def _stack(self, blocks):
+        """
+        Stack blocks of candidate individuals into a single array
+
+        Each block is a tuple (individuals, fitness), where fitness is None if
+        the values are not known yet. Return the individuals, the fitness
+        values, and the mask of those that are known, as expected by _rank_pop.
         """
-        Execute a generation of the GA
+        indivs = np.concatenate([block for block, _ in blocks])
+        fitness = np.concatenate([
+            fit if fit is not None else
+            np.zeros(len(block), dtype=self._pop.fitness.dtype)
+            for block, fit in blocks])
+        known = np.concatenate([np.full(len(block), fit is not None)
+                                for block, fit in blocks])
+        return indivs, fitness, known
+    
+    def _steady_state_step(self):
         """
-        parents = self._select_parents()
+        Execute a step of the steady-state GA
+
+        Only k = steady_state new individuals are bred: the children of k / 2
+        pairs of parents drawn from the whole population (two children per
+        pair, as in _apply_crossover) and the mutants of those parents, plus
+        the incoming individuals. They compete with the k worst individuals of
+        the population for their places, so that only O(k) individuals are
+        built and evaluated in each step, instead of O(pop_size).
+
+        The winners overwrite the rows of the k worst individuals in place,
+        and only the ranking of the rows (see population) is updated, so the
+        rest of the individuals are never moved.
+
+        The crossover probability and elitism are not used: the best
+        individuals are never replaced. Duplicates are only suppressed among
+        the entrants and the worst individuals, and if that leaves fewer than
+        k of them, the displaced worst individuals keep the rest of the places
+        (see _refill), so the size of the population does not change.
+        """
+        k = min(self._steady_state, len(self._pop))
+        ranking = self._pop.ranking()
+        # The selection engine works on ranks, mapped back to rows
+        selector = self._selector(self._pop.fitness[ranking])
+        parents_idx1, parents_idx2 = selector.sample_pairs(-(-k // 2))
+        parents1 = np.concatenate((parents_idx1, parents_idx2))[:k]
+        parents2 = np.concatenate((parents_idx2, parents_idx1))[:k]
+        worst = ranking[-k:]
+        displaced = self._pop[worst]
         newpop = []
         if self._incoming_population:
-            newpop.extend(self._incoming_population)
-        newpop.extend(self._apply_crossover(parents))
-        newpop.extend(self._apply_mutation(parents))
-        if self._elitism:
-            newpop.extend(indiv for (indiv, _) in self._pop[:self._elitism])
-        self._pop = self._rank_pop(newpop)
-        gen_best_sol, gen_best_obj = self._pop[0]
-        if gen_best_obj < self._best_obj or self._best_obj is None:
+            newpop.append((self._as_array(self._incoming_population), None))
+        newpop.append((self._crossover_batch(
+            self._pop.indivs[ranking[parents1]],
+            self._pop.indivs[ranking[parents2]]), None))
+        parents = ranking[np.unique(np.concatenate((parents1, parents2)))]
+        newpop.append(self._apply_mutation(self._pop[parents]))
+        newpop.append((displaced.indivs, displaced.fitness))
+        entrants = self._improve(self._rank_pop(*self._stack(newpop), size=k))
+        if len(entrants) < k:
+            entrants = self._refill(entrants, displaced, k)
+        self._pop.indivs[worst] = entrants.indivs
+        self._pop.fitness[worst] = entrants.fitness
+        # Both the kept rows and the entrants are sorted, so the entrants are
+        # inserted into the ranking after the kept ones with equal fitness
+        kept = ranking[:-k]
+        places = np.searchsorted(self._pop.fitness[kept], entrants.fitness,
+                                 side='right')
+        self._pop.order = np.insert(kept, places, worst)
+    
+    def _refill(self, entrants, displaced, k):
+        """
+        Return the entrants completed up to k individuals with the displaced
+        ones, sorted by fitness
+
+        The displaced individuals that are not among the entrants are taken
+        first, best first; copies are only used if there are not enough of
+        them.
+        """
+        taken = set(self._cache_keys(entrants.indivs))
+        keys = self._cache_keys(displaced.indivs)
+        new = [pos for pos, key in enumerate(keys) if key not in taken]
+        copies = [pos for pos, key in enumerate(keys) if key in taken]
+        fill = np.array((new + copies)[:k - len(entrants)], dtype=np.intp)
+        indivs = np.concatenate((entrants.indivs, displaced.indivs[fill]))
+        fitness = np.concatenate((entrants.fitness, displaced.fitness[fill]))
+        order = np.argsort(fitness, kind='stable')
+        return population(indivs[order], fitness[order])
+
+    def _run_iteration(self):
+        """
+        Execute a generation of the GA (a step, in steady-state mode)
+        """
+        if self._steady_state:
+            self._steady_state_step()
+        else:
+            parents = self._select_parents()
+            # The new candidates are gathered as blocks of (individuals,
+            # fitness) and stacked into a single array to be ranked
+            newpop = []
+            if self._incoming_population:
+                newpop.append((self._as_array(self._incoming_population),
+                               None))
+            newpop.append((self._apply_crossover(parents), None))
+            newpop.append(self._apply_mutation(parents))
+            if self._elitism:
+                newpop.append((self._pop.indivs[:self._elitism],
+                               self._pop.fitness[:self._elitism]))
+            ranked = self._improve(self._rank_pop(*self._stack(newpop)))
+            # Duplicate suppression can leave places for the previous
+            # generation
+            if len(ranked) < self._pop_size:
+                ranked = self._refill(ranked, self._pop, self._pop_size)
+            self._pop = ranked
+        gen_best_sol, gen_best_obj = self._pop.best()
+        if self._best_obj is None or gen_best_obj < self._best_obj:
             self._best_obj, self._best_sol = gen_best_obj, gen_best_sol
         self._num_iters += 1
     
     def print_pop(self):
         print("Population")
-        for indiv, fit in self._pop:
+        for indiv, fit in self._pop[self._pop.ranking()]:
             print(indiv, fit)
         print()
 
@@ -319,7 +678,7 @@ class ga():
         """
         Standard execution, mainly for testing
         """
-        if not self._pop:
+        if not len(self._pop):
             self.initialize_population()
         while not self._end_condition():
             self._run_iteration()
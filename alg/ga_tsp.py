@@ -11,7 +11,11 @@ This file is distributed under the MIT license (http://opensource.org/licenses/M
 """
 
 import random
+import numpy as np
 from ga import ga
+from fitcache import tour_hash
+from eax import eax
+from diversity import arc_distance
 
 class ga_tsp(ga):
     """
@@ -19,7 +23,9 @@ class ga_tsp(ga):
     """
     def __init__(self, cost_matrix, pop_size=50, elitism=0, crossover_prob=0.5,
                  mutation_prob=0.5, max_iter=1000, rand_seed=None,
-                 rand_offset=0):
+                 rand_offset=0, cache_size=0, local_search=None, ls_top_k=1,
+                 stop_criteria=None, selection="roulette", tournament_size=2,
+                 steady_state=0, crossover="order", suppress_duplicates=True):
         """
         Initialization of the GA:
         The following parametres are needed (defaults will be used if no
@@ -34,17 +40,51 @@ class ga_tsp(ga):
         - Maximum number of iterations
         - Random Seed: a seed can be provided to replicate a result; if no seed
           is provided, the rng is initialized in the standard fashion
-        - Random Offset: If a number > 0 is provided, the state of the rng will
-          be advanced by that quantity (useful for parallel runs with
-          deterministic seeds by providing a different offset for each instance)
+        - Random Offset: If a number > 0 is provided along with a seed, the
+          rng is seeded from both, so each offset gives a different stream
+          (useful for parallel runs with deterministic seeds by providing a
+          different offset for each instance)
+        - Cache Size: maximum number of fitness values to keep in a cache to
+          avoid evaluating again tours already seen; 0 disables the cache
+        - Local Search: an object with an improve_batch(tours, costs) method
+          returning the improved tours and costs (e.g. a
+          localsearch.local_search), applied each generation to the best
+          individuals; None disables the memetic stage
+        - Local Search Top k: number of best individuals improved by the local
+          search each generation
+        - Stop Criteria: additional end conditions (see the stopping module),
+          checked after the maximum number of iterations; the name of the one
+          that ends the run is kept in _stop_reason
+        - Selection: "roulette" or "tournament" (see ga.__init__)
+        - Tournament Size: number of individuals in each tournament
+        - Steady State: if > 0, number of worst individuals replaced in each
+          step of the steady-state mode, instead of whole generations
+        - Crossover: "order" for the order crossover (see _crossover), or "eax"
+          for the edge assembly crossover (see the eax module), which keeps
+          the arcs of the parents instead of the positions of the cities
+        - Suppress Duplicates: if True, only one copy of each tour (in any
+          rotation) is kept when ranking
         Additionally, the GA is reset by instantiating an empty population
         and setting the best solution and fitness value to None, and
         zeroing the iteration counter
         """
         self._cost_matrix = cost_matrix
+        # Array version of the cost matrix for batch evaluation, cm[a, b] is the
+        # cost of the arc from a to b
+        self._cm = np.asarray(cost_matrix)
         ng = len(cost_matrix)
+        # Tours are identified in the fitness cache by their hash, the same
+        # for all the rotations of a tour
+        self._tour_hash = tour_hash(ng, rotations=True)
+        self._local_search = local_search
+        self._ls_top_k = ls_top_k
+        if crossover not in ("order", "eax"):
+            raise ValueError("Unknown crossover: {}".format(crossover))
+        self._eax = eax(self._cm) if crossover == "eax" else None
         super().__init__(ng, pop_size, elitism, crossover_prob, mutation_prob,
-                         max_iter, rand_seed, rand_offset)
+                         max_iter, rand_seed, rand_offset, cache_size,
+                         stop_criteria, selection, tournament_size,
+                         steady_state, suppress_duplicates)
 
     def initialize_population(self):
         """
@@ -53,7 +93,7 @@ class ga_tsp(ga):
         Create a number of random permutations of the cities.
         """
 
-        cities = range(self._num_genes)
+        cities = list(range(self._num_genes))
         pop = []
         for _ in range(self._pop_size):
             new_indiv = cities[:]
@@ -62,6 +102,13 @@ class ga_tsp(ga):
             
         self._pop = self._rank_pop(pop)
 
+    def _as_array(self, pop):
+        """
+        Convert a sequence of tours into the array used to store them in a
+        population: a contiguous matrix with one tour per row
+        """
+        return np.asarray(pop, dtype=np.int32).reshape(-1, self._num_genes)
+
     def _crossover(self, parent1, parent2):
         """
         Crossover operation
@@ -70,7 +117,13 @@ class ga_tsp(ga):
         parent given by two cut points, and place it in the same position in
         the offspring; then fill the rest of the offspring with the remaining
         elements in the order they appear in the second parent
+
+        With the edge assembly crossover, the child is built from the arcs of
+        the parents instead (see the eax module).
         """
+        if self._eax is not None:
+            return np.asarray(self._eax.cross(parent1, parent2,
+                                              self._np_random)[0])
         # select cutting points (0 to num_genes, as there is the possibility to
         # have the chunk include the last element when slicing by idx1:idx2)
         idx1 = self._random.randint(0, self._num_genes)
@@ -82,15 +135,59 @@ class ga_tsp(ga):
         else:  # invert the indices so that idx1 < idx2
             idx1, idx2 = idx2, idx1
 
+        parent1 = np.asarray(parent1)
+        parent2 = np.asarray(parent2)
         chunk = parent1[idx1:idx2]
-        others = parent2[:]
-        for elem in chunk:
-            others.remove(elem)
+        # Membership bitmap of the chunk, so that its elements are dropped from
+        # the second parent in a single pass
+        in_chunk = np.zeros(self._num_genes, dtype=bool)
+        in_chunk[chunk] = True
+        others = parent2[~in_chunk[parent2]]
         # Build offspring
-        offspring = others[:idx1]
-        offspring.extend(chunk)
-        offspring.extend(others[idx1:])
+        return np.concatenate((others[:idx1], chunk, others[idx1:]))
+
+    def _crossover_batch(self, parents1, parents2):
+        """
+        Batch crossover operation
+
+        Same order crossover as in _crossover, building the children of all
+        the pairs of parents (rows of parents1 and parents2) at once, with a
+        pair of cut points for each child drawn the same way.
+
+        The chunk positions of each child are given by a mask over the matrix;
+        a membership bitmap (one row per child) marks the cities in each chunk,
+        and the rest of the positions are filled with the cities of the second
+        parent that are not in the bitmap. Since there are as many free
+        positions as remaining cities in each row, and boolean indexing goes
+        row by row, a single masked assignment keeps the order of the second
+        parent.
+
+        The edge assembly crossover is applied to each pair in turn.
+        """
+        parents1 = self._as_array(parents1)
+        parents2 = self._as_array(parents2)
+        if self._eax is not None:
+            return self._as_array([
+                self._eax.cross(parent1, parent2, self._np_random)[0]
+                for parent1, parent2 in zip(parents1, parents2)])
+        num_children = len(parents1)
+        ng = self._num_genes
+        # Cut points, as in _crossover
+        idx1 = self._np_random.integers(0, ng + 1, size=num_children)
+        idx2 = self._np_random.integers(0, ng, size=num_children)
+        idx2 += idx2 >= idx1
+        idx1, idx2 = np.minimum(idx1, idx2), np.maximum(idx1, idx2)
+
+        positions = np.arange(ng)
+        chunk = ((positions >= idx1[:, np.newaxis]) &
+                 (positions < idx2[:, np.newaxis]))
+        rows = np.arange(num_children)[:, np.newaxis]
+        in_chunk = np.zeros((num_children, ng), dtype=bool)
+        in_chunk[rows, parents1] = chunk
 
+        offspring = np.empty_like(parents1)
+        offspring[chunk] = parents1[chunk]
+        offspring[~chunk] = parents2[~in_chunk[rows, parents2]]
         return offspring
 
 
@@ -108,10 +205,85 @@ class ga_tsp(ga):
         # Offset the missing potential value idx1 if needed
         if idx2 >= idx1:
             idx2 += 1
-        new_indiv = indiv[:]
+        new_indiv = list(indiv)
         new_indiv[idx1], new_indiv[idx2] = new_indiv[idx2], new_indiv[idx1]
         return new_indiv
 
+    def _apply_mutation(self, pop):
+        """
+        Application of the mutation operation to the selected parents
+
+        Same swap mutation as in _mutation, applied to all the selected parents
+        at once. The fitness of each mutant is obtained from the fitness of its
+        parent: only the arcs starting right before and at each of the swapped
+        positions change, so the difference in cost is calculated over those
+        (at most four arcs removed and four added), in constant time per
+        mutant.
+        """
+        mutate = self._np_random.random(len(pop)) <= self._mutation_prob
+        offspring = pop.indivs[mutate]
+        num_mutants = len(offspring)
+        ng = self._num_genes
+        # Positions to swap, as in _mutation
+        idx1 = self._np_random.integers(0, ng, size=num_mutants)
+        idx2 = self._np_random.integers(0, ng - 1, size=num_mutants)
+        idx2 += idx2 >= idx1
+
+        # Start positions of the affected arcs; when the swapped positions are
+        # adjacent (also across the ends of the tour) the same arc appears
+        # twice, and only the first occurrence is kept
+        starts = np.stack((idx1 - 1, idx1, idx2 - 1, idx2), axis=1) % ng
+        first = np.ones(starts.shape, dtype=bool)
+        for col in range(1, starts.shape[1]):
+            first[:, col] = (starts[:, :col] != starts[:, col:col+1]).all(axis=1)
+
+        rows = np.arange(num_mutants)
+        delta = -self._arcs_cost(offspring, starts, first)
+        offspring[rows, idx1], offspring[rows, idx2] = \
+            offspring[rows, idx2], offspring[rows, idx1]
+        delta += self._arcs_cost(offspring, starts, first)
+        return offspring, pop.fitness[mutate] + delta
+
+    def _improve(self, pop):
+        """
+        Memetic stage: improve the best ls_top_k tours of the ranked population
+        with the local search, if there is one, and rank it again
+        """
+        if self._local_search is None:
+            return pop
+        top = min(self._ls_top_k, len(pop))
+        tours, costs = self._local_search.improve_batch(
+            pop.indivs[:top], pop.fitness[:top].tolist())
+        pop.indivs[:top] = tours
+        pop.fitness[:top] = costs
+        return pop[np.argsort(pop.fitness, kind='stable')]
+
+    def _cache_keys(self, indivs):
+        """
+        Return the list of keys identifying each tour in the fitness cache: a
+        64 bit hash of the permutation, rotated to start with city 0
+        """
+        return self._tour_hash(indivs).tolist()
+
+    def _distance(self, indivs1, indivs2):
+        """
+        Return the distance between each pair of tours: the fraction of the
+        arcs of the first one not in the second one
+        """
+        return arc_distance(indivs1, indivs2)
+
+    def _arcs_cost(self, tours, starts, mask):
+        """
+        Sum of the costs of selected arcs in each tour
+
+        starts holds, for each tour (row), the positions where the arcs start,
+        and mask the ones to include in the sum.
+        """
+        rows = np.arange(len(tours))[:, np.newaxis]
+        orig = tours[rows, starts]
+        dest = tours[rows, (starts + 1) % self._num_genes]
+        return (self._cm[orig, dest] * mask).sum(axis=1)
+
 
     def _fitness(self, indiv, close_tour=True):
         """
@@ -124,7 +296,7 @@ class ga_tsp(ga):
         counting the arc from the last to the first element of the sequence.
         Otherwise, this arc is not included.
         """
-        shifted_indiv = indiv[1:]
+        shifted_indiv = list(indiv[1:])
         # Add the first element if closing the tour for the zip to include
         # the last to first elements arc. As zip is truncated to the shortest
         # sequence, just not adding this is enough when not colsing the loop
@@ -133,6 +305,24 @@ class ga_tsp(ga):
         arcs = zip(indiv, shifted_indiv)
         return sum(self._cost_matrix[o][d] for (o, d) in arcs)
 
+    def _fitness_batch(self, pop):
+        """
+        Batch fitness function
+
+        Same as _fitness (closed tours) for a whole population: the tours are
+        stacked as the rows of a matrix, and the costs of all the arcs are
+        gathered from the cost matrix in a single indexing operation, pairing
+        each city with the next one in its tour (cyclic shift). Return an array
+        with the cost of each tour.
+
+        A subclass that only overrides _fitness gets it applied to each tour
+        instead.
+        """
+        if type(self)._fitness is not ga_tsp._fitness:
+            return np.array([self._fitness(tour) for tour in pop])
+        tours = np.asarray(pop)
+        return self._cm[tours, np.roll(tours, -1, axis=1)].sum(axis=1)
+
 
 if __name__ == "__main__":
     cm = [[0, 4, 4, 4, 4, 4, 4, 4, 4, 1],
@@ -0,0 +1,215 @@
+"""
+Local search for ENDOF (Endof New Distributed Optimiaztion Framework)
+
+Improvement of tours for the asymmetric TSP, to be used as a memetic stage by
+the population based algorithms (improving the best individuals or ants of each
+iteration).
+
+Only moves that keep the direction of every part of the tour are used, since
+reversing a segment changes its cost in asymmetric instances:
+- Or-opt: move a segment of up to three consecutive cities to another place
+- Reversal-free 3-opt (segment insertion): remove three arcs and reconnect the
+  two resulting paths in the only way that keeps their direction, which swaps
+  two consecutive segments of the tour
+
+Both are searched with nearest neighbour candidate lists and don't-look bits,
+with an optional budget of moves or time for each call.
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+import time
+from collections import deque
+from candidates import candidate_lists, cost_lookup
+
+
+class local_search(cost_lookup):
+    """
+    Or-opt and reversal-free 3-opt local search for asymmetric TSP tours
+    """
+    def __init__(self, cost_matrix, num_neighbours=10, max_moves=None,
+                 time_limit=None, or_opt=True, three_opt=True, max_segment=3):
+        """
+        Initialization of the local search:
+        - Cost matrix, where cost_matrix[a][b] is the cost of the arc from a to
+          b (not assumed to be symmetric)
+        - Number of neighbours in the candidate lists of each city
+        - Maximum number of improving moves to apply in each call to
+          improve_batch (None for no limit)
+        - Time limit in seconds for each call to improve_batch (None for no
+          limit)
+        - Whether to use the Or-opt and the reversal-free 3-opt moves
+        - Maximum length of the segments moved by Or-opt
+        """
+        cm = self._set_cost_matrix(cost_matrix)
+        # Cheapest successors and predecessors of each city
+        self._succ_cands = candidate_lists(cm, num_neighbours).tolist()
+        self._pred_cands = candidate_lists(cm.T, num_neighbours).tolist()
+        self._max_moves = max_moves
+        self._time_limit = time_limit
+        self._or_opt = or_opt
+        self._three_opt = three_opt
+        self._max_segment = max_segment
+
+    def improve_batch(self, tours, costs):
+        """
+        Improve a set of tours with their costs, sharing the budget of moves
+        and time among them (in order, so the first ones should be the most
+        relevant). Return the lists of improved tours and their costs.
+        """
+        deadline = None
+        if self._time_limit is not None:
+            deadline = time.perf_counter() + self._time_limit
+        moves_left = self._max_moves
+        new_tours = []
+        new_costs = []
+        for tour, cost in zip(tours, costs):
+            if moves_left is None or moves_left > 0:
+                tour, cost, moves = self.improve(tour, cost, moves_left,
+                                                 deadline)
+                if moves_left is not None:
+                    moves_left -= moves
+            new_tours.append(list(tour))
+            new_costs.append(cost)
+        return new_tours, new_costs
+
+    def improve(self, tour, cost, max_moves=None, deadline=None):
+        """
+        Apply improving moves to a tour until it is a local optimum or the
+        budget (number of moves, time.perf_counter() deadline) is exhausted.
+        Return the new tour (as a list), its cost and the number of moves.
+        """
+        tour = list(tour)
+        n = len(tour)
+        if n < 5:
+            return tour, cost, 0
+        pos = [0] * n
+        for i, city in enumerate(tour):
+            pos[city] = i
+        # Don't-look bits: only the cities in the queue are considered as the
+        # start of a move; the ones around an applied move are put back in
+        active = deque(tour)
+        queued = [True] * n
+        moves = 0
+        while active:
+            if max_moves is not None and moves >= max_moves:
+                break
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            city = active.popleft()
+            queued[city] = False
+            move = self._find_move(city, tour, pos)
+            if move is None:
+                continue
+            gain, a, b, c = move
+            touched = (a, tour[(pos[a] + 1) % n], b, tour[(pos[b] + 1) % n],
+                       c, tour[(pos[c] + 1) % n])
+            self._exchange(tour, pos, a, b, c)
+            cost -= gain
+            moves += 1
+            for city in touched:
+                if not queued[city]:
+                    queued[city] = True
+                    active.append(city)
+        return tour, cost, moves
+
+    def _find_move(self, x, tour, pos):
+        """
+        Look for an improving move around city x (first improvement)
+
+        Return None if none is found, or a tuple (gain, a, b, c) meaning that
+        the segments tour[a+1..b] and tour[b+1..c] (positions of the cities,
+        cyclically) are swapped, see _exchange.
+        """
+        if self._three_opt:
+            move = self._three_opt_move(x, tour, pos)
+            if move is not None:
+                return move
+        if self._or_opt:
+            return self._or_opt_move(x, tour, pos)
+        return None
+
+    def _three_opt_move(self, a, tour, pos):
+        """
+        Reversal-free 3-opt with a as the start of the first removed arc
+
+        The arcs (a, a'), (b, b'), (c, c') are replaced by (a, b'), (c, a') and
+        (b, c'), with b' among the cheapest successors of a and c' among those
+        of b, and the partial gain of the first exchange required to be
+        positive.
+        """
+        cost = self._cost
+        n = len(tour)
+        pa = pos[a]
+        a_next = tour[(pa + 1) % n]
+        cost_a = cost[a, a_next]
+        for b_next in self._succ_cands[a]:
+            gain1 = cost_a - cost[a, b_next]
+            if gain1 <= 0:
+                # Candidates are sorted by cost, no better ones left
+                break
+            r_b_next = (pos[b_next] - pa) % n
+            if r_b_next < 2:
+                continue
+            b = tour[(pos[b_next] - 1) % n]
+            gain1 += cost[b, b_next]
+            for c_next in self._succ_cands[b]:
+                # c' must come after b' in the tour (a itself is allowed)
+                r_c_next = (pos[c_next] - pa) % n or n
+                if r_c_next <= r_b_next:
+                    continue
+                c = tour[(pos[c_next] - 1) % n]
+                gain = (gain1 + cost[c, c_next] - cost[c, a_next] -
+                        cost[b, c_next])
+                if gain > 0:
+                    return gain, a, b, c
+        return None
+
+    def _or_opt_move(self, x, tour, pos):
+        """
+        Or-opt for the segments starting at x
+
+        The segment x..y (up to max_segment cities), between p and q, is moved
+        between a and its successor b, with a among the cheapest predecessors
+        of x, or b among the cheapest successors of y.
+        """
+        cost = self._cost
+        n = len(tour)
+        px = pos[x]
+        p = tour[(px - 1) % n]
+        for length in range(1, min(self._max_segment, n - 3) + 1):
+            y = tour[(px + length - 1) % n]
+            q = tour[(px + length) % n]
+            removal_gain = cost[p, x] + cost[y, q] - cost[p, q]
+            if removal_gain <= 0:
+                continue
+            insertion_points = (self._pred_cands[x] +
+                                [tour[(pos[b] - 1) % n]
+                                 for b in self._succ_cands[y]])
+            for a in insertion_points:
+                # a can't be in the segment, or be p (no change)
+                r_a = (pos[a] - px) % n
+                if r_a < length or r_a == n - 1:
+                    continue
+                b = tour[(pos[a] + 1) % n]
+                gain = (removal_gain + cost[a, b] - cost[a, x] -
+                        cost[y, b])
+                if gain > 0:
+                    # Moving x..y after a swaps it with q..a
+                    return gain, p, y, a
+        return None
+
+    def _exchange(self, tour, pos, a, b, c):
+        """
+        Swap the consecutive segments a'..b and b'..c of the tour in place (the
+        prime denotes the successor), updating the positions
+        """
+        n = len(tour)
+        start = pos[a]
+        rotated = tour[start:] + tour[:start]
+        r_b = (pos[b] - start) % n
+        r_c = (pos[c] - start) % n
+        tour[:] = (rotated[:1] + rotated[r_b+1:r_c+1] + rotated[1:r_b+1] +
+                   rotated[r_c+1:])
+        for i, city in enumerate(tour):
+            pos[city] = i
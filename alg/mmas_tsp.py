@@ -0,0 +1,198 @@
+"""
+MAX-MIN Ant System class for ENDOF (Endof New Distributed Optimiaztion
+Framework)
+
+This is a variant of the TSP ant colony (see aco_tsp) following the MAX-MIN Ant
+System by Stutzle and Hoos: only one ant deposits pheromone each iteration
+(the iteration best or the best so far), the pheromone is kept between the
+bounds tau_min and tau_max derived from the best cost so far, and it is reset
+to tau_max when the search stagnates (the pheromone has converged and the best
+solution so far has not improved for a while).
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+import numpy as np
+from aco_tsp import aco_tsp
+
+
+class mmas_tsp(aco_tsp):
+    """
+    MAX-MIN Ant System for solving the travelling salesman problem
+    """
+    # The pheromone is considered converged when the average lambda-branching
+    # factor (number of arcs leaving a city with pheromone above tau_min +
+    # lambda * (tau_max - tau_min)) falls below this
+    _branch_lambda = 0.05
+    _converged_branching = 1.1
+
+    def __init__(self, cost_matrix, num_ants=50, default_ph=1,
+                 evaporation=0.98, heuristics=None, alpha=1, beta=2,
+                 max_iter=1000, rand_seed=None, rand_offset=0, cache_size=0,
+                 local_search=None, ls_top_k=1, stop_criteria=None,
+                 num_candidates=None, candidates=None, batch_ants=False,
+                 dtype=np.float32, sparse_ph=False, p_best=0.05,
+                 global_best_freq=5, reinit_iters=250, num_workers=0,
+                 suppress_duplicates=True):
+        """
+        Initialization of the MMAS:
+        The parametres are those of aco_tsp (see aco_tsp.__init__), except for
+        the number of ants depositing pheromone and the elitism, which are
+        replaced by the following ones:
+        - p_best: probability of an ant building the best solution so far
+          once the pheromone has converged to it, used to derive tau_min from
+          tau_max (see _update_bounds)
+        - Global Best Frequency: the best ant so far deposits pheromone every
+          this number of iterations, and the best ant of the iteration the
+          rest of them (1 for always the best so far, 0 for always the best
+          of the iteration)
+        - Reinit Iterations: the pheromone is reset to tau_max when it has
+          converged (see _branching_factor) and the best solution so far has
+          not improved for at least this number of iterations (0 disables it)
+        The default pheromone is only used until the first bounds are known,
+        after the first iteration, when the pheromone is set to tau_max.
+        """
+        # Bounds of the (true) pheromone, set once there is a best solution
+        self._tau_min = None
+        self._tau_max = None
+        self._p_best = p_best
+        self._global_best_freq = global_best_freq
+        self._reinit_iters = reinit_iters
+        # Iteration of the last improvement of the best solution so far
+        self._last_improvement = 0
+        super().__init__(cost_matrix, num_ants, default_ph, evaporation,
+                         heuristics, 1, 0, alpha, beta, max_iter, rand_seed,
+                         rand_offset, cache_size, local_search, ls_top_k,
+                         stop_criteria, num_candidates, candidates, batch_ants,
+                         dtype, sparse_ph, num_workers, suppress_duplicates)
+
+    def _update_bounds(self, best_obj):
+        """
+        Set the pheromone bounds from the cost of the best solution so far
+
+        tau_max is the limit of the pheromone of the arcs of the best solution
+        when it deposits every iteration, deposit / (1 - evaporation) with the
+        deposit of 1 / (1 + cost) used by the colony. tau_min is set so that,
+        with all the pheromone converged to the bounds, an ant builds the best
+        solution with probability p_best, assuming an average of half of the
+        choices (cities, or candidates) available at each step.
+        """
+        n = self._sol_length
+        self._tau_max = 1.0 / ((1 - self._evaporation) * (1 + best_obj))
+        if self._candidates is not None:
+            avg_choices = self._candidates.shape[1] / 2.0
+        else:
+            avg_choices = n / 2.0
+        p_dec = self._p_best ** (1.0 / n)
+        if avg_choices > 1:
+            tau_min = (self._tau_max * (1 - p_dec) /
+                       ((avg_choices - 1) * p_dec))
+        else:
+            tau_min = self._tau_max
+        self._tau_min = min(tau_min, self._tau_max)
+
+    def _branching_factor(self):
+        """
+        Return the average lambda-branching factor of the pheromone matrix
+
+        For each city, the arcs leaving it (to its candidates, if there are
+        candidate lists) with pheromone over min + lambda * (max - min) of
+        those arcs are counted, and the counts averaged over the cities. A
+        value close to 1 means that the colony keeps building the same tour.
+        """
+        ph = self._pheromones
+        if self._candidates is not None and not self._sparse_ph:
+            ph = np.take_along_axis(ph, self._candidates, axis=1)
+        elif not self._sparse_ph:
+            # The diagonal is not an arc
+            ph = ph.copy()
+            np.fill_diagonal(ph, np.nan)
+        ph_min = np.nanmin(ph, axis=1)
+        ph_max = np.nanmax(ph, axis=1)
+        cutoff = ph_min + self._branch_lambda * (ph_max - ph_min)
+        return float(np.mean(np.sum(ph >= cutoff[:, np.newaxis], axis=1)))
+
+    def _reset_ph(self):
+        """
+        Set all the pheromone to tau_max
+        """
+        self._pheromones.fill(self._tau_max)
+        self._ph_scale = 1.0
+        self._choice = None
+
+    def _update_ph(self, pop):
+        """
+        Update the pheromone matrix with a single ant
+
+        The first element of pop is the best ant of the iteration. When it
+        improves the best solution so far, the bounds are updated (and the
+        pheromone initialized to tau_max the first time). The ant depositing
+        pheromone is the best so far every global_best_freq iterations, and the
+        best of the iteration otherwise. After reinit_iters iterations without
+        improvement, if the pheromone has converged, it is reset instead.
+
+        The pheromone is kept within the bounds when evaporating (see
+        _evaporate).
+        """
+        iter_best = pop[0]
+        if self._best_obj is None or iter_best[1] < self._best_obj:
+            first = self._tau_max is None
+            self._update_bounds(iter_best[1])
+            self._last_improvement = self._num_iters
+            if first:
+                self._reset_ph()
+            global_best = iter_best
+        else:
+            global_best = (self._best_sol, self._best_obj)
+        if (self._reinit_iters and
+                self._num_iters - self._last_improvement >=
+                self._reinit_iters and
+                self._branching_factor() < self._converged_branching):
+            self._reset_ph()
+            self._last_improvement = self._num_iters
+            return
+        if (self._global_best_freq and
+                (self._num_iters + 1) % self._global_best_freq == 0):
+            super()._update_ph([global_best])
+        else:
+            super()._update_ph([iter_best])
+
+    def _evaporate(self):
+        """
+        Apply evaporation and keep the pheromone within [tau_min, tau_max]
+
+        Unlike evaporation, the bounds do not affect all the values equally, so
+        they are applied to the whole matrix, and the choice information is
+        refreshed for the values changed.
+        """
+        super()._evaporate()
+        if self._tau_max is None:
+            return
+        # Bounds relative to the evaporation scale factor of the stored values
+        ph = self._pheromones
+        low = ph < self._tau_min / self._ph_scale
+        high = ph > self._tau_max / self._ph_scale
+        ph[low] = self._tau_min / self._ph_scale
+        ph[high] = self._tau_max / self._ph_scale
+        if self._choice is not None:
+            changed = low | high
+            self._choice[changed] = (ph[changed] ** self._alpha *
+                                     self._heur_beta[changed])
+
+
+if __name__ == "__main__":
+    cm = [[0, 4, 4, 4, 4, 4, 4, 4, 4, 1],
+          [1, 0, 4, 4, 4, 4, 4, 4, 4, 4],
+          [4, 1, 0, 4, 4, 4, 4, 4, 4, 4],
+          [4, 4, 1, 0, 4, 4, 4, 4, 4, 4],
+          [4, 4, 4, 1, 0, 4, 4, 4, 4, 4],
+          [4, 4, 4, 4, 1, 0, 4, 4, 4, 4],
+          [4, 4, 4, 4, 4, 1, 0, 4, 4, 4],
+          [4, 4, 4, 4, 4, 4, 1, 0, 4, 4],
+          [4, 4, 4, 4, 4, 4, 4, 1, 0, 4],
+          [4, 4, 4, 4, 4, 4, 4, 4, 1, 0],]
+    max_it = 100
+    mymmas = mmas_tsp(cm, max_iter=max_it)
+    mymmas._run()
+    print(mymmas._best_sol, mymmas._best_obj)
+    print(mymmas.pheromones())
@@ -0,0 +1,198 @@
+"""
+Selection engine for ENDOF (Endof New Distributed Optimiaztion Framework)
+
+Roulette wheel (fitness proportional) selection over a fixed set of weights,
+with logarithmic cost per draw instead of a linear scan of the population.
+There is also tournament selection over a ranked set of elements, which needs
+no weights at all.
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+import numpy as np
+
+
+class roulette():
+    """
+    Roulette wheel selection
+
+    Each element i is selected with probability proportional to weights[i].
+    Draws with replacement (including pairs of different elements) use the
+    prefix sums of the weights and a binary search, vectorized for any number
+    of draws. Draws without replacement use a Fenwick (binary indexed) tree of
+    the weights, so that removing a selected element and searching the prefix
+    sums are both O(log n).
+    """
+    def __init__(self, weights, rng):
+        """
+        Build the selection engine for the given weights, using rng (a numpy
+        random generator) for the draws
+        """
+        self._weights = np.asarray(weights, dtype=float)
+        self._cumsum = np.cumsum(self._weights)
+        self._rng = rng
+
+    def _search(self, values):
+        """
+        Return the positions of the first elements with prefix sum strictly
+        greater than each of the values (so zero weights are never selected)
+        """
+        idx = np.searchsorted(self._cumsum, values, side='right')
+        # Guard against rounding at the upper end of the range
+        return np.minimum(idx, len(self._cumsum) - 1)
+
+    def sample(self, size):
+        """
+        Return an array of size positions drawn with replacement
+        """
+        return self._search(self._rng.random(size) * self._cumsum[-1])
+
+    def sample_pairs(self, size):
+        """
+        Return two arrays of positions (first, second) for size pairs
+
+        The first element of each pair is drawn from all the elements, and the
+        second one from all the elements except the first one (which is
+        equivalent to drawing from the range with the weight of the first
+        element removed, and skipping over it).
+        """
+        first = self.sample(size)
+        first_weights = self._weights[first]
+        pvals = self._rng.random(size) * (self._cumsum[-1] - first_weights)
+        # Values past the start of the first element skip over it
+        first_start = self._cumsum[first] - first_weights
+        pvals += np.where(pvals >= first_start, first_weights, 0)
+        return first, self._search(pvals)
+
+    def sample_without_replacement(self, size, exclude=()):
+        """
+        Return an array of size different positions, drawn one after the other
+        with probabilities proportional to the weights of the elements not
+        selected yet
+
+        The positions in exclude are never selected, and neither are those with
+        zero weight, so fewer than size positions are returned if there are not
+        enough elements with positive weight.
+        """
+        num = len(self._weights)
+        current = self._weights.tolist()
+        for pos in exclude:
+            current[pos] = 0.0
+        remaining = sum(1 for weight in current if weight > 0)
+        # Fenwick tree: tree[i] holds the sum of the weights in (i - lsb(i), i]
+        # (1-based positions), built in linear time
+        tree = [0.0] + current
+        for i in range(1, num + 1):
+            parent = i + (i & -i)
+            if parent <= num:
+                tree[parent] += tree[i]
+        top_bit = 1 << (num.bit_length() - 1) if num else 0
+
+        selected = []
+        for rnd in self._rng.random(min(size, remaining)).tolist():
+            # The total is the prefix sum of all the elements, taken from the
+            # tree each time so that it matches the sums used in the descent
+            total = 0.0
+            i = num
+            while i:
+                total += tree[i]
+                i -= i & -i
+            pval = rnd * total
+            # Descend the tree to find the first position with prefix sum
+            # greater than pval
+            pos = 0
+            step = top_bit
+            while step:
+                nxt = pos + step
+                if nxt <= num and tree[nxt] <= pval:
+                    pos = nxt
+                    pval -= tree[nxt]
+                step >>= 1
+            if pos >= num or current[pos] <= 0:
+                # Rounding in the tree sums led past the last element or to
+                # one already removed: take the closest one still available
+                pos = self._closest_available(current, min(pos, num - 1))
+            # Remove the selected element from the tree
+            weight = current[pos]
+            current[pos] = 0.0
+            i = pos + 1
+            while i <= num:
+                tree[i] -= weight
+                i += i & -i
+            selected.append(pos)
+        return np.array(selected, dtype=np.intp)
+
+    @staticmethod
+    def _closest_available(current, pos):
+        """
+        Return the last position up to pos with positive weight in current, or
+        the first one after it if there are none
+        """
+        for cand in range(pos, -1, -1):
+            if current[cand] > 0:
+                return cand
+        for cand in range(pos + 1, len(current)):
+            if current[cand] > 0:
+                return cand
+        raise ValueError("No elements with positive weight left")
+
+
+class tournament():
+    """
+    Tournament selection
+
+    The elements are assumed to be ranked, best first (e.g. a ranked
+    population), so the winner of a tournament among some random elements is
+    just the one with the lowest position, and no fitness values or weights
+    are needed. Each draw costs O(tournament size). The methods are the same
+    as those of roulette, so both can be used interchangeably.
+    """
+    def __init__(self, num, size, rng):
+        """
+        Build the selection engine for num ranked elements, with tournaments of
+        size elements, using rng (a numpy random generator) for the draws
+        """
+        self._num = num
+        self._size = size
+        self._rng = rng
+
+    def sample(self, size):
+        """
+        Return an array with the winners of size tournaments (with
+        replacement)
+        """
+        entrants = self._rng.integers(0, self._num, size=(size, self._size))
+        return entrants.min(axis=1)
+
+    def sample_pairs(self, size):
+        """
+        Return two arrays of positions (first, second) for size pairs
+
+        The second element of each pair wins a tournament among all the
+        elements except the first one.
+        """
+        first = self.sample(size)
+        entrants = self._rng.integers(0, self._num - 1,
+                                      size=(size, self._size))
+        # Skip over the first element
+        entrants += entrants >= first[:, np.newaxis]
+        return first, entrants.min(axis=1)
+
+    def sample_without_replacement(self, size, exclude=()):
+        """
+        Return an array of size different positions, the winners of successive
+        tournaments among the elements not selected yet
+
+        The positions in exclude are never selected.
+        """
+        excluded = set(exclude)
+        available = [pos for pos in range(self._num) if pos not in excluded]
+        selected = []
+        for _ in range(min(size, len(available))):
+            entrants = self._rng.integers(0, len(available), size=self._size)
+            winner = min(entrants.tolist(), key=available.__getitem__)
+            selected.append(available[winner])
+            # Remove the winner, moving the last element into its place
+            available[winner] = available[-1]
+            available.pop()
+        return np.array(selected, dtype=np.intp)
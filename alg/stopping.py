@@ -0,0 +1,85 @@
+"""
+Stop criteria for ENDOF (Endof New Distributed Optimiaztion Framework)
+
+Pluggable end conditions for the iterative algorithms. Each criterion is
+checked once per iteration with the number of iterations run and the best
+objective value so far, and returns True when the run should stop. The name of
+the criterion is used to record which one stopped the run.
+
+This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
+"""
+
+import time
+
+
+class max_iterations():
+    """
+    Stop when a number of iterations has been reached
+    """
+    name = "max_iter"
+
+    def __init__(self, max_iter):
+        self._max_iter = max_iter
+
+    def check(self, num_iters, best_obj):
+        return num_iters >= self._max_iter
+
+
+class stagnation():
+    """
+    Stop when the best objective value has not improved for a number of
+    iterations
+    """
+    name = "stagnation"
+
+    def __init__(self, max_stalled):
+        self._max_stalled = max_stalled
+        self._best_obj = None
+        self._last_improvement = 0
+
+    def check(self, num_iters, best_obj):
+        if best_obj is not None and (self._best_obj is None or
+                                     best_obj < self._best_obj):
+            self._best_obj = best_obj
+            self._last_improvement = num_iters
+        return num_iters - self._last_improvement >= self._max_stalled
+
+
+class target_gap():
+    """
+    Stop when the best objective value is within a relative gap of a target
+    value (e.g. the best known solution for the instance): best <= target *
+    (1 + gap). A gap of 0 means stopping only when the target is reached.
+    """
+    name = "target_gap"
+
+    def __init__(self, target, gap=0.0):
+        self._threshold = target * (1 + gap)
+
+    def check(self, num_iters, best_obj):
+        return best_obj is not None and best_obj <= self._threshold
+
+
+class time_budget():
+    """
+    Stop when a wall-clock time budget in seconds is exhausted. Time is counted
+    from the creation of the criterion.
+    """
+    name = "time_budget"
+
+    def __init__(self, seconds):
+        self._deadline = time.time() + seconds
+
+    def check(self, num_iters, best_obj):
+        return time.time() >= self._deadline
+
+
+def first_fired(criteria, num_iters, best_obj):
+    """
+    Check the criteria in order, and return the name of the first one that
+    fires, or None if the run should go on
+    """
+    for criterion in criteria:
+        if criterion.check(num_iters, best_obj):
+            return criterion.name
+    return None
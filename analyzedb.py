@@ -3,7 +3,7 @@
 Analyze the results of running ENDOF by performing several calcualtions and
 plots on the information stored in the endof database.
 
-For each type of experiment (ga, aco, sched), build:
+For each type of experiment (ga, aco, mmas, sched), build:
 - a table of the percentage improvement of multiverse in average and best
   solutions compared to the multistart results, and percentage improvement
   in running and wall time
@@ -159,7 +159,7 @@ def draw_boxplot(table, factor, exp_type):
               values in the multistart experiments
     - factor: the factor to use, such as 'best_sol' or 'hypervol'; it is used
               to construct the fields used for table as shown above
-    - exp_type: the type of experiment ('ga' or 'aco'), used for
+    - exp_type: the type of experiment ('ga', 'aco' or 'mmas'), used for
                 labelling the graph
 
     Outputs:
@@ -395,7 +395,7 @@ def draw_hv_plots(db, table, exp_type):
 db = MySQLdb.connect(host="localhost", user="endof", passwd="endof", db="endof")
 cur = db.cursor()
 
-experiment_types = ['ga', 'aco']
+experiment_types = ['ga', 'aco', 'mmas']
 
 for exp_type in experiment_types:
     print()
@@ -12,8 +12,19 @@ several modes. Two of them are implemented here:
   evolutive metaheuristics). This version checks that at least four nodes are
   present and exits otherwise.
 
+In both modes, the runs go in lockstep by default: rank 0 signals each
+iteration and waits for all the runs to complete it. In asynchronous mode,
+each run iterates at its own pace, sending its progress to rank 0 without
+waiting, and rank 0 aggregates (and forwards to the multiverse run) whatever
+has arrived.
+
 The optimization methods available for use are those of the alg module.
 
+The instance is loaded once per node, and the cost matrix (and the heuristics,
+for the ACO) are kept in MPI shared memory windows that all the processes of
+the node map without any copy, so the memory they take does not grow with the
+number of processes.
+
 This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
 """
 
@@ -21,9 +32,15 @@ This file is distributed under the MIT license (http://opensource.org/licenses/M
 import os
 import sys
 import getopt
+import numpy as np
 from mpi4py import MPI
-from parsetsp import parsetsp
+from parsetsp import parsetsp, bestknownsols
 import alg
+# The modules in alg import each other by their bare names
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'alg'))
+from alg.stopping import (max_iterations, stagnation, target_gap, time_budget,
+                          first_fired)
 
 
 comm = MPI.COMM_WORLD
@@ -39,9 +56,9 @@ MULTIVERSE = 1
 
 # Get execution parametres from command line arguments
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "hm:a:f:r:i:s:")
+    opts, args = getopt.getopt(sys.argv[1:], "hm:a:f:r:i:s:l:t:g:w:c:bp:k:n:ey")
 except getopt.GetoptError:
-    print "Error parsing command line"
+    print("Error parsing command line")
     sys.exit(2)
 
 mode = None
@@ -50,12 +67,62 @@ inputfile = None
 report_step = 10
 maxiter = 100
 seed = None
+ls_top_k = 0
+stagnation_iters = None
+target_rel_gap = None
+wall_time = None
+num_candidates = None
+batch_ants = False
+num_workers = 0
+steady_state = 0
+tournament_size = None
+crossover = "order"
+asynchronous = False
 
 
 def print_help():
-    print("mpi_multirun.py -m mode -a alg -f inputfile -r report_step -i iterations -s seed")
+    print("mpi_multirun.py -m mode -a alg -f inputfile -r report_step -i iterations -s seed -l local_search -t stagnation -g gap -w wall_time -c candidates [-b] -p workers -k steady_state -n tournament_size [-e] [-y]")
     print("mode: MULTISTART | MULTIVERSE")
-    print("alg: ga | aco")
+    print("alg: ga | aco | mmas")
+    print("local_search: number of best individuals/ants improved by local search each iteration (default 0, disabled)")
+    print("stagnation: stop after this number of iterations without improvement")
+    print("gap: stop when within this relative gap of the best known solution (e.g. 0.01)")
+    print("wall_time: stop after this number of seconds")
+    print("candidates: (aco, mmas) number of nearest neighbours each ant considers first (default: all cities)")
+    print("-b: (aco, mmas) build the tours of the whole colony together, one step at a time")
+    print("steady_state: (ga) number of worst individuals replaced each iteration, instead of whole generations (default 0, disabled)")
+    print("tournament_size: (ga) select parents by tournaments of this size instead of roulette")
+    print("-e: (ga) use the edge assembly crossover (EAX) instead of the order crossover")
+    print("workers: (aco, mmas) number of processes building the ants of each instance (default: none, built by the instance itself)")
+    print("-y: run the instances asynchronously, each one at its own pace, instead of in lockstep")
+
+
+def shared_array(node_comm, shape, dtype, rows, block_size=1024):
+    """
+    Return an MPI shared memory window holding a matrix, and a read-only array
+    view of the window in every process of node_comm
+
+    The matrix, of the given shape and dtype, is filled by the first process
+    of node_comm with the blocks of rows returned by rows(start, stop), one
+    block at a time, so that no other full copy of it is ever built (e.g. from
+    the distances provider of a coordinate instance). The arguments are
+    ignored in the rest of the processes.
+
+    The window must be freed (Free) when the array is no longer needed.
+    """
+    node_root = node_comm.Get_rank() == 0
+    shape, dtype = node_comm.bcast((shape, np.dtype(dtype)) if node_root
+                                   else None, root=0)
+    nbytes = int(np.prod(shape)) * dtype.itemsize if node_root else 0
+    win = MPI.Win.Allocate_shared(nbytes, dtype.itemsize, comm=node_comm)
+    buf, _ = win.Shared_query(0)
+    shared = np.ndarray(shape, dtype=dtype, buffer=buf)
+    if node_root:
+        for start in range(0, shape[0], block_size):
+            shared[start:start + block_size] = rows(start, start + block_size)
+    node_comm.Barrier()
+    shared.flags.writeable = False
+    return win, shared
 
 
 for opt, arg in opts:
@@ -63,7 +130,7 @@ for opt, arg in opts:
         if rank == 0:
             print("mpi_multirun.py -m mode -a alg")
             print("mode: MULTISTART | MULTIVERSE")
-            print("alg: ga | aco")
+            print("alg: ga | aco | mmas")
         sys.exit()
     elif opt == '-m':
         if arg.lower() == "multistart":
@@ -76,7 +143,7 @@ for opt, arg in opts:
             sys.exit(2)
     elif opt == '-a':
         arg_lower = arg.lower()
-        if arg_lower in ("ga", "aco"):
+        if arg_lower in ("ga", "aco", "mmas"):
             alg_selection = arg_lower
         else:
             if rank == 0:
@@ -90,6 +157,28 @@ for opt, arg in opts:
         maxiter = int(arg)
     elif opt == '-s':
         seed = float(arg)
+    elif opt == '-l':
+        ls_top_k = int(arg)
+    elif opt == '-t':
+        stagnation_iters = int(arg)
+    elif opt == '-g':
+        target_rel_gap = float(arg)
+    elif opt == '-w':
+        wall_time = float(arg)
+    elif opt == '-c':
+        num_candidates = int(arg)
+    elif opt == '-b':
+        batch_ants = True
+    elif opt == '-p':
+        num_workers = int(arg)
+    elif opt == '-k':
+        steady_state = int(arg)
+    elif opt == '-n':
+        tournament_size = int(arg)
+    elif opt == '-e':
+        crossover = "eax"
+    elif opt == '-y':
+        asynchronous = True
 
 # Check input
 if mode is None or alg_selection is None or inputfile is None:
@@ -103,22 +192,65 @@ if (mode == MULTISTART and size < 2) or (mode == MULTIVERSE and size < 4):
         print("Too few processes", rank, "for  mode", mode)
     exit()
 
+# Load the instance once per node, and build the cost matrix directly in a
+# window shared by the processes of the node (coordinate instances are never
+# materialized anywhere else)
+node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+if node_comm.Get_rank() == 0:
+    dist = parsetsp(inputfile).distances
+    cm_win, cost_matrix = shared_array(node_comm, (dist.size, dist.size),
+                                       dist.dtype, dist.rows)
+    # Only the shared copy is kept
+    del dist
+else:
+    cm_win, cost_matrix = shared_array(node_comm, None, None, None)
+windows = [cm_win]
+
 # Algorithms
 if alg_selection == 'ga':
     if rank== 0:
         pass
     elif rank >= 1:
         from alg.ga_tsp import ga_tsp
-        tsp = parsetsp(inputfile)
-        myalg = ga_tsp(tsp.cm, elitism=2, rand_seed=seed, rand_offset=17*rank)
+        from alg.localsearch import local_search
+        ls = local_search(cost_matrix) if ls_top_k else None
+        selection = "roulette" if tournament_size is None else "tournament"
+        myalg = ga_tsp(cost_matrix, elitism=2, rand_seed=seed,
+                       rand_offset=17*rank, local_search=ls, ls_top_k=ls_top_k,
+                       selection=selection, tournament_size=tournament_size or 2,
+                       steady_state=steady_state, crossover=crossover)
         myalg.initialize_population()
-elif alg_selection == 'aco':
+elif alg_selection in ('aco', 'mmas'):
+    candidates = None
+    # The default heuristics, raised to beta (the default one of each
+    # algorithm) once for all the processes of the node, so the colonies use
+    # them as they are (beta 1), without a copy of their own
+    beta = 2 if alg_selection == 'mmas' else 1
+    heur_win, heuristics = shared_array(
+        node_comm, cost_matrix.shape, np.float32,
+        lambda start, stop: (1.0 / (1 + cost_matrix[start:stop])) ** beta)
+    windows.append(heur_win)
     if rank== 0:
         pass
     elif rank >= 1:
         from alg.aco_tsp import aco_tsp
-        tsp = parsetsp(inputfile)
-        myalg = aco_tsp(tsp.cm, rand_seed=seed, rand_offset=17*rank)
+        from alg.mmas_tsp import mmas_tsp
+        from alg.localsearch import local_search
+        from alg.candidates import candidate_lists
+        # The candidate lists (cheapest successors, i.e. best default
+        # heuristic) are built once by the first worker and shared
+        if rank == 1 and num_candidates:
+            candidates = candidate_lists(cost_matrix, num_candidates)
+    if num_candidates:
+        candidates = comm.bcast(candidates, root=1)
+    if rank >= 1:
+        ls = local_search(cost_matrix) if ls_top_k else None
+        aco_class = mmas_tsp if alg_selection == 'mmas' else aco_tsp
+        myalg = aco_class(cost_matrix, heuristics=heuristics, beta=1,
+                          rand_seed=seed, rand_offset=17*rank,
+                          local_search=ls, ls_top_k=ls_top_k,
+                          candidates=candidates, batch_ants=batch_ants,
+                          num_workers=num_workers)
 else:
     if rank == 0:
         print("Unrecognized algorithm", alg_selection)
@@ -128,6 +260,8 @@ else:
 SEND_SOL = 19
 SEND_MULTIV_SOL = 17
 UPDATE_SOLS = 13
+STOP_RUN = 11
+FINAL_SOL = 23
 
 # Parametre init
 if mode == MULTISTART:
@@ -145,8 +279,32 @@ else:
         print("bad mode")
     exit()
 
+# Stop criteria, checked by rank 0 on the overall best solution after each
+# iteration; the workers run until rank 0 signals them to stop
+stop_criteria = [max_iterations(maxiter)]
+if stagnation_iters is not None:
+    stop_criteria.append(stagnation(stagnation_iters))
+if target_rel_gap is not None:
+    instance = os.path.splitext(os.path.basename(inputfile))[0]
+    # The best known solutions are looked up next to the instance file
+    sols_file = os.path.join(os.path.dirname(inputfile), 'bestknownsols')
+    try:
+        best_known = bestknownsols(sols_file).get(instance)
+    except OSError:
+        if rank == 0:
+            print("Cannot read best known solutions from", sols_file)
+        sys.exit(2)
+    if best_known is not None:
+        stop_criteria.append(target_gap(best_known, target_rel_gap))
+    elif rank == 0:
+        print("No best known solution for", instance)
+stop_reason = None
+num_iters = 0
+
 # Start up the processes
 comm.barrier()
+if wall_time is not None:
+    stop_criteria.append(time_budget(wall_time))
 
 # Run iterations
 next_step = True
@@ -154,13 +312,110 @@ new_best = sys.float_info.max
 best_obj = sys.float_info.max
 best_sol = sys.float_info.max
 
-if mode == MULTISTART:
+if asynchronous:
+    status = MPI.Status()
+    if rank == 0:
+        runs = range(1, size)
+        # Iterations of each run as last reported before the stop, and at the
+        # end of the run
+        reported_iters = dict.fromkeys(runs, 0)
+        final_iters = {}
+        # Best solutions of the clones not forwarded yet to the multiverse run
+        new_sols = {}
+        requests = []
+        while stop_reason is None:
+            # Wait for a report, then take all those that have already arrived
+            reports = [comm.recv(source=MPI.ANY_SOURCE, tag=SEND_SOL,
+                                 status=status)]
+            sources = [status.Get_source()]
+            while comm.iprobe(source=MPI.ANY_SOURCE, tag=SEND_SOL,
+                              status=status):
+                sources.append(status.Get_source())
+                reports.append(comm.recv(source=sources[-1], tag=SEND_SOL))
+            for source, (run_iters, run_obj, run_sol) in zip(sources, reports):
+                reported_iters[source] = run_iters
+                # The solution is only sent when it improves
+                if run_sol is None:
+                    continue
+                if source != multiverse_process:
+                    new_sols[source] = run_sol
+                if run_obj < best_obj:
+                    best_obj = run_obj
+                    best_sol = run_sol
+            if multiverse_process is not None and new_sols:
+                requests.append(comm.isend(new_sols, dest=multiverse_process,
+                                           tag=UPDATE_SOLS))
+                new_sols = {}
+            requests = [req for req in requests if not req.Test()]
+            # Progress is that of the most advanced run
+            prev_iters = num_iters
+            num_iters = max(reported_iters.values())
+            if num_iters // report_step > prev_iters // report_step:
+                print("iteration: {}; best sol: {}".format(num_iters, best_obj))
+            stop_reason = first_fired(stop_criteria, num_iters, best_obj)
+        # Signal the runs to stop, and collect their last reports and final
+        # results
+        for run in runs:
+            requests.append(comm.isend(None, dest=run, tag=STOP_RUN))
+        while len(final_iters) < len(runs):
+            run_iters, run_obj, run_sol = comm.recv(source=MPI.ANY_SOURCE,
+                                                    tag=MPI.ANY_TAG,
+                                                    status=status)
+            if status.Get_tag() == FINAL_SOL:
+                final_iters[status.Get_source()] = run_iters
+            if run_sol is not None and run_obj < best_obj:
+                best_obj = run_obj
+                best_sol = run_sol
+        MPI.Request.Waitall(requests)
+        num_iters = max(final_iters.values())
+        # Iterations of each run that rank 0 had not seen when it stopped
+        staleness = {run: final_iters[run] - reported_iters[run]
+                     for run in runs}
+    else:
+        requests = []
+        # Best solution of each clone, for the multiverse run
+        clone_sols = {}
+        reported_obj = None
+        run_iters = 0
+        stop = False
+        while True:
+            # Take the updates and stop signal that have arrived, in order
+            while comm.iprobe(source=0, tag=MPI.ANY_TAG, status=status):
+                msg = comm.recv(source=0, tag=status.Get_tag())
+                if status.Get_tag() == STOP_RUN:
+                    stop = True
+                else:
+                    clone_sols.update(msg)
+            # The multiverse run performs a last iteration after the stop is
+            # signaled to integrate the last solutions from the other runs
+            if stop and rank != multiverse_process:
+                break
+            if rank == multiverse_process:
+                myalg._incoming_population = list(clone_sols.values())
+            myalg._run_iteration()
+            run_iters += 1
+            if stop:
+                break
+            best_obj = myalg._best_obj
+            improved = reported_obj is None or best_obj < reported_obj
+            sol = myalg._best_sol if improved else None
+            requests.append(comm.isend((run_iters, best_obj, sol), dest=0,
+                                       tag=SEND_SOL))
+            if improved:
+                reported_obj = best_obj
+            requests = [req for req in requests if not req.Test()]
+        MPI.Request.Waitall(requests)
+        comm.send((run_iters, myalg._best_obj, myalg._best_sol), dest=0,
+                  tag=FINAL_SOL)
+
+elif mode == MULTISTART:
     if rank == 0:
         for i in range(maxiter):
             # signal workers for next iteration
             comm.bcast(next_step, root=0)
             # wait for all workers to perform the step: receive best objs
-            new_best_obj, new_best = comm.reduce(best_obj, op=MPI.MINLOC)
+            new_best_obj, new_best = comm.reduce((best_obj, rank),
+                                                 op=MPI.MINLOC)
             # update minimum cost and the solution that yielded it
             if new_best_obj >= best_obj or new_best == 0:
                 comm.bcast(-1, root=0)
@@ -170,6 +425,10 @@ if mode == MULTISTART:
                 best_obj = new_best_obj
             if (i+1) % report_step == 0:
                 print("iteration: {}; best sol: {}".format(i+1, best_obj))
+            num_iters = i + 1
+            stop_reason = first_fired(stop_criteria, num_iters, best_obj)
+            if stop_reason is not None:
+                break
         # Signal workers for exit signal
         next_step = False
         comm.bcast(next_step, root=0)
@@ -185,7 +444,7 @@ if mode == MULTISTART:
             best_obj = myalg._best_obj
             best_sol = myalg._best_sol
             # Send best obj so far to signal completion
-            comm.reduce(best_obj, op=MPI.MINLOC)
+            comm.reduce((best_obj, rank), op=MPI.MINLOC)
             new_best = comm.bcast(new_best, root=0)
             if new_best == rank:
                 comm.send(best_sol, dest=0, tag=SEND_SOL)
@@ -223,6 +482,11 @@ elif mode == MULTIVERSE:
                 best_sol = new_best_sol
             if (i+1) % report_step == 0:
                 print("iteration: {}; best sol: {}".format(i+1, best_obj))
+            # The multiverse process runs one last iteration
+            num_iters = i + 2
+            stop_reason = first_fired(stop_criteria, num_iters, best_obj)
+            if stop_reason is not None:
+                break
         # Last update + iteration step for the multiverse worker
         comm.send(best_sols, dest=multiverse_process, tag=UPDATE_SOLS)
         # Signal workers for exit signal
@@ -268,9 +532,24 @@ elif mode == MULTIVERSE:
     else:
         print("This is not OK")
 
+# Stop the ant construction workers
+if alg_selection in ('aco', 'mmas') and rank >= 1:
+    myalg.close()
+
 # Report solution
 if rank == 0:
-    print("iteration: {}; best sol: {}".format(maxiter, best_obj))
+    # The last lines are read by results2db, so the progress of each run goes
+    # before them
+    if asynchronous:
+        for run in runs:
+            print("rank {}: iterations: {}; staleness: {}".format(
+                run, final_iters[run], staleness[run]))
+    print("stop criterion: {}".format(stop_reason))
+    print("iteration: {}; best sol: {}".format(num_iters, best_obj))
     print("solution: {}".format(best_sol))
     if seed is not None:
         print("random seed: {}".format(seed))
+
+# Release the shared instance
+for win in windows:
+    win.Free()
@@ -2,32 +2,343 @@
 Read TSPLIB benchmark files and transform them into the cost matrix needed for
 ENDOF (Endof New Distributed Optimization Framework)
 
+Both kinds of TSPLIB instances are supported:
+- Explicit weights (EDGE_WEIGHT_TYPE: EXPLICIT) in any EDGE_WEIGHT_FORMAT: the
+  full matrix, or the upper/lower triangle (with or without the diagonal) of a
+  symmetric matrix, by rows or by columns.
+- Node coordinates (EUC_2D, EUC_3D, CEIL_2D, MAN_2D, MAN_3D, MAX_2D, MAX_3D,
+  ATT, GEO), with the distances defined by TSPLIB. These are not turned into a
+  matrix unless it is requested: the distances are computed on demand, for
+  single arcs or blocks of rows, so that large instances fit in memory.
+
+The cost matrix of explicit instances is cached in a binary file next to the
+source (see parsetsp.parse), so that later loads just map it in memory.
+
 This file is distributed under the MIT license (http://opensource.org/licenses/MIT)
 """
 
+import glob
+import hashlib
+import os
+import tempfile
+import numpy as np
+
+
+# Keywords that start a data section of a TSPLIB file
+SECTIONS = ("EDGE_WEIGHT_SECTION", "NODE_COORD_SECTION",
+            "DISPLAY_DATA_SECTION", "FIXED_EDGES_SECTION", "DEMAND_SECTION",
+            "DEPOT_SECTION", "TOUR_SECTION")
+
+
+def _nint(values):
+    """Nearest integer, as defined by TSPLIB: (int) (x + 0.5)"""
+    return np.floor(values + 0.5).astype(np.int64)
+
+
+def _geo_radians(values):
+    """
+    Convert TSPLIB GEO coordinates (DDD.MM, degrees and minutes) to radians
+    """
+    pi = 3.141592
+    degrees = np.trunc(values)
+    minutes = values - degrees
+    return pi * (degrees + 5.0 * minutes / 3.0) / 180.0
+
+
+class matrix_distances(object):
+    """Distance provider for an explicit cost matrix"""
+
+    def __init__(self, matrix):
+        self._matrix = matrix
+        self.size = len(matrix)
+        self.dtype = matrix.dtype
+
+    def __call__(self, orig, dest):
+        """Return the costs of the arcs from orig to dest (arrays of cities)"""
+        return self._matrix[orig, dest]
+
+    def rows(self, start, stop):
+        """Return the block of rows start to stop - 1 of the cost matrix"""
+        return self._matrix[start:stop]
+
+    def matrix(self):
+        """Return the cost matrix"""
+        return self._matrix
+
+
+class coord_distances(object):
+    """Distance provider for TSPLIB instances given by node coordinates
+
+    The distances are computed as needed from the coordinates (one row per
+    city), with the rounding of each TSPLIB EDGE_WEIGHT_TYPE, and never stored.
+    """
+
+    def __init__(self, coords, weight_type):
+        if weight_type not in ("EUC_2D", "EUC_3D", "CEIL_2D", "MAN_2D",
+                               "MAN_3D", "MAX_2D", "MAX_3D", "ATT", "GEO"):
+            raise ValueError("Unsupported EDGE_WEIGHT_TYPE: {}".format(
+                weight_type))
+        self._weight_type = weight_type
+        dims = 3 if weight_type.endswith("3D") else 2
+        self._coords = np.asarray(coords, dtype=float)[:, :dims]
+        if weight_type == "GEO":
+            self._coords = _geo_radians(self._coords)
+        self.size = len(self._coords)
+        # Type of the blocks of rows and of the matrix
+        self.dtype = np.dtype(np.int32)
+
+    def __call__(self, orig, dest):
+        """
+        Return the distances from orig to dest (arrays of cities, broadcast
+        against each other)
+        """
+        c1 = self._coords[orig]
+        c2 = self._coords[dest]
+        wt = self._weight_type
+        if wt == "GEO":
+            rrr = 6378.388
+            q1 = np.cos(c1[..., 1] - c2[..., 1])
+            q2 = np.cos(c1[..., 0] - c2[..., 0])
+            q3 = np.cos(c1[..., 0] + c2[..., 0])
+            arg = np.clip(0.5 * ((1.0 + q1) * q2 - (1.0 - q1) * q3), -1, 1)
+            dist = (rrr * np.arccos(arg) + 1.0).astype(np.int64)
+            # A city is at distance 0 from itself
+            return np.where(np.asarray(orig) == np.asarray(dest), 0, dist)
+        diff = np.abs(c1 - c2)
+        if wt.startswith("MAN"):
+            return _nint(diff.sum(axis=-1))
+        if wt.startswith("MAX"):
+            return np.max(_nint(diff), axis=-1)
+        squared = (diff * diff).sum(axis=-1)
+        if wt == "ATT":
+            rij = np.sqrt(squared / 10.0)
+            tij = _nint(rij)
+            return np.where(tij < rij, tij + 1, tij)
+        if wt == "CEIL_2D":
+            return np.ceil(np.sqrt(squared)).astype(np.int64)
+        return _nint(np.sqrt(squared))
+
+    def rows(self, start, stop):
+        """Return the block of rows start to stop - 1 of the cost matrix"""
+        stop = min(stop, self.size)
+        orig = np.arange(start, stop)[:, np.newaxis]
+        return self(orig, np.arange(self.size)).astype(np.int32)
+
+    def matrix(self, block_size=1024):
+        """
+        Build the whole cost matrix (n^2 values), one block of rows at a time
+        to keep the temporary arrays small
+        """
+        cm = np.empty((self.size, self.size), dtype=np.int32)
+        for start in range(0, self.size, block_size):
+            cm[start:start + block_size] = self.rows(start, start + block_size)
+        return cm
+
+
 class parsetsp(object):
-    """Read a TSP problem specification from TSPLIB and build the cost matrix"""
-
-    def __init__(self, inputfile):
-        self.name, self.cm = self.parse(inputfile)
-
-
-    def parse(self, inputfile):
-        with open(inputfile, 'r') as f:
-            line = f.readline()
-            name = line.split()[-1]
-            # Skip 6 rows, get size
-            for _ in range(6):
-                line = f.readline()
-                if line.startswith("DIMENSION"):
-                    size = int(line.split()[-1])
-            cm = []
-            numbers = []
-            line = f.readline()
-            while not line.startswith("EOF"):
-                numbers.extend(int(n) for n in line.split())
-                if len(numbers) >= size:
-                    cm.append(numbers[:size])
-                    numbers = numbers[size:]
-                line = f.readline()
-        return name, cm
+    """Read a TSP problem specification from TSPLIB and build the cost matrix
+
+    The header keywords are available in the header dictionary (and the most
+    common ones as name, dimension, weight_type and weight_format), and the
+    distances in the distances provider (see matrix_distances and
+    coord_distances). The cost matrix is available as an n-by-n int32 array
+    (array), and as a list of lists (cm); for coordinate instances, they are
+    only built the first time they are used.
+    """
+
+    def __init__(self, inputfile, cache=True):
+        """
+        Read the instance in inputfile, using the binary cache of its cost
+        matrix unless cache is False (see parse)
+        """
+        self.name, self.distances = self.parse(inputfile, cache)
+        self._array = None
+        self._cm = None
+
+    @property
+    def array(self):
+        """Cost matrix as an array, array[a, b] being the cost from a to b"""
+        if self._array is None:
+            self._array = self.distances.matrix()
+        return self._array
+
+    @property
+    def cm(self):
+        """Cost matrix as a list of lists, cm[a][b] being the cost from a to b"""
+        if self._cm is None:
+            self._cm = self.array.tolist()
+        return self._cm
+
+    def parse(self, inputfile, cache=True):
+        """
+        Parse the file and return the name of the instance and the provider of
+        the distances
+
+        The header is read keyword by keyword ("KEY: value" lines), and the
+        numbers of each data section (up to the next keyword, or EOF) are
+        converted in a single pass.
+
+        With cache, the cost matrix of an explicit instance is saved the first
+        time in a .npy file next to the source, named after a hash of the
+        contents of the source, and later loads memory-map that file read-only
+        instead of parsing the weights (so the processes on a node share the
+        same pages). A change in the source changes the hash, so the old cache
+        is ignored, and replaced. Coordinate instances are not cached, as the
+        matrix is never built unless it is used.
+        """
+        with open(inputfile, 'rb') as f:
+            data = f.read()
+        cache_file = self._cache_file(inputfile, data) if cache else None
+        lines = data.decode().splitlines()
+        # With a cache, the weights may not be needed at all
+        cached = cache_file is not None and os.path.exists(cache_file)
+        sections = self._read(lines, header_only=cached)
+        self.dimension = int(self.header["DIMENSION"])
+        self.weight_type = self.header.get("EDGE_WEIGHT_TYPE", "EXPLICIT")
+        self.weight_format = self.header.get("EDGE_WEIGHT_FORMAT",
+                                             "FULL_MATRIX")
+        name = self.header.get("NAME")
+
+        if self.weight_type == "EXPLICIT":
+            matrix = self._load_cache(cache_file)
+            if matrix is not None:
+                return name, matrix_distances(matrix)
+        if cached:
+            # The cache cannot be used (e.g. it is corrupt), so the data
+            # sections are needed after all
+            sections = self._read(lines)
+        if self.weight_type == "EXPLICIT":
+            weights = self._numbers(sections["EDGE_WEIGHT_SECTION"])
+            matrix = self._explicit_matrix(weights)
+            if cache_file is not None:
+                # Replaces the cache that could not be used, if any
+                self._save_cache(cache_file, matrix)
+            return name, matrix_distances(matrix)
+        coords = self._numbers(sections["NODE_COORD_SECTION"])
+        # Rows of node number and coordinates
+        coords = coords.reshape(self.dimension, -1)[:, 1:]
+        return name, coord_distances(coords, self.weight_type)
+
+    def _read(self, lines, header_only=False):
+        """
+        Read the header keywords into the header dictionary, and return the
+        lines of each data section in a dictionary by section keyword
+
+        With header_only, the reading stops at the first line of data, and no
+        sections are returned.
+        """
+        self.header = {}
+        sections = {}
+        current = None
+        for line in lines:
+            stripped = line.strip()
+            if not stripped:
+                continue
+            keyword = stripped.split(':')[0].strip()
+            if keyword in SECTIONS:
+                current = sections.setdefault(keyword, [])
+            elif keyword == "EOF":
+                current = None
+            elif current is not None and header_only:
+                # The header is complete
+                return {}
+            elif ':' in stripped and stripped[0].isalpha():
+                key, _, value = stripped.partition(':')
+                self.header[key.strip()] = value.strip()
+                current = None
+            elif current is not None:
+                current.append(line)
+        return sections
+
+    def _cache_file(self, inputfile, data):
+        """
+        Return the path of the cache for inputfile with the given contents
+        """
+        digest = hashlib.sha1(data).hexdigest()[:16]
+        return "{}.{}.npy".format(inputfile, digest)
+
+    def _load_cache(self, cache_file):
+        """
+        Return the cached cost matrix, memory-mapped read-only, or None if
+        there is no cache or it cannot be read
+        """
+        if cache_file is None or not os.path.exists(cache_file):
+            return None
+        try:
+            matrix = np.load(cache_file, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if matrix.shape != (self.dimension, self.dimension):
+            return None
+        return matrix
+
+    def _save_cache(self, cache_file, matrix):
+        """
+        Save the cost matrix in the cache, removing the caches of previous
+        versions of the source
+
+        The file is written under a temporary name and then renamed, so other
+        processes never see it partially written. Errors (e.g. a read-only
+        directory) are ignored, as the cache is only an optimization.
+        """
+        # Strip the hash and the extension
+        prefix = cache_file.rsplit('.', 2)[0]
+        try:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(cache_file) or '.',
+                                       suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, matrix)
+            os.replace(tmp, cache_file)
+            for old in glob.glob(glob.escape(prefix) + ".*.npy"):
+                if old != cache_file:
+                    os.remove(old)
+        except OSError:
+            pass
+
+    def _numbers(self, lines):
+        """Convert the lines of a data section into an array of numbers"""
+        # Text mode parsing of the numbers, in C
+        return np.fromstring(' '.join(lines), dtype=float, sep=' ')
+
+    def _explicit_matrix(self, weights):
+        """
+        Build the cost matrix from the weights of the EDGE_WEIGHT_SECTION,
+        according to the EDGE_WEIGHT_FORMAT
+        """
+        n = self.dimension
+        weights = weights.astype(np.int64)
+        fmt = self.weight_format
+        if fmt == "FULL_MATRIX":
+            return weights[:n * n].astype(np.int32).reshape(n, n)
+        # The triangles by columns are the opposite triangles by rows of the
+        # (symmetric) matrix
+        by_rows = {"UPPER_ROW": (np.triu_indices, 1),
+                   "LOWER_ROW": (np.tril_indices, -1),
+                   "UPPER_DIAG_ROW": (np.triu_indices, 0),
+                   "LOWER_DIAG_ROW": (np.tril_indices, 0),
+                   "UPPER_COL": (np.tril_indices, -1),
+                   "LOWER_COL": (np.triu_indices, 1),
+                   "UPPER_DIAG_COL": (np.tril_indices, 0),
+                   "LOWER_DIAG_COL": (np.triu_indices, 0)}
+        if fmt not in by_rows:
+            raise ValueError("Unsupported EDGE_WEIGHT_FORMAT: {}".format(fmt))
+        indices, offset = by_rows[fmt]
+        rows, cols = indices(n, offset)
+        matrix = np.zeros((n, n), dtype=np.int32)
+        matrix[rows, cols] = weights[:len(rows)]
+        matrix[cols, rows] = weights[:len(rows)]
+        return matrix
+
+
+def bestknownsols(inputfile="tspsamples/bestknownsols"):
+    """
+    Read the file with the best known solutions for the instances (lines like
+    "name: value") and return them as a dictionary by instance name
+    """
+    sols = {}
+    with open(inputfile, 'r') as f:
+        for line in f:
+            parts = line.split(':')
+            if len(parts) == 2 and parts[1].strip().isdigit():
+                sols[parts[0].strip()] = int(parts[1])
+    return sols
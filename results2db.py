@@ -4,7 +4,7 @@ Framework) and store the information in a MySQL database.
 
 This assumes that there is an 'endof' database available with the suitable
 schema: a <pre>_instances and a <pre>_iters table for each type of test,
-where <pre> stands for the type: ga, aco.
+where <pre> stands for the type: ga, aco, mmas.
 
 The instances table contains the information global to each run: which problem
 instance it used, the running times, whether multiverse was used or not, etc. The
@@ -91,7 +91,9 @@ for filename in logfiles:
 
     with open("data/" + filename, 'r') as f:
         lines = [line for line in f]
-    iters_lines = lines[:-4]
+    # Skip other information in the log, e.g. the stop criterion
+    iters_lines = [line for line in lines[:-4]
+                   if line.startswith("iteration:")]
     random_seed_line = lines[-3]
     time_line = lines[-2]
     random_seed = float(random_seed_line.split()[2])
@@ -18,14 +18,17 @@ import re
 import random
 
 
-tspproblems = os.listdir("tspsamples")
-tspproblems.remove('bestknownsols')
+# Only the instances, not the binary caches of their cost matrices (see
+# parsetsp)
+tspproblems = [name for name in os.listdir("tspsamples")
+               if name.endswith(".atsp")]
 
 
 def execcommand(folder, problem, num_procs, alg, method, report_step, max_iter, n):
     seed = random.random()
     logfile = "{}_{}_{}_{}_{}.log".format(problem, num_procs, alg, method, n)
-    return "time /usr/bin/mpiexec -n {} /usr/bin/python mpi_multirun.py -f {}/{} -a {} -m {} -r {} -i {} -s {} &> {}".format(num_procs, folder, problem, alg, method, report_step, max_iter, seed, logfile)
+    stop_opts = "" if stagnation is None else "-t {} ".format(stagnation)
+    return "time /usr/bin/mpiexec -n {} /usr/bin/python mpi_multirun.py -f {}/{} -a {} -m {} -r {} -i {} -s {} {}&> {}".format(num_procs, folder, problem, alg, method, report_step, max_iter, seed, stop_opts, logfile)
 
 
 def iters_from_name(name, mult=10):
@@ -37,6 +40,8 @@ def iters_from_name(name, mult=10):
 num_procs = 4
 instances = 25
 report_step = 1
+# Iterations without improvement before stopping early (None to disable)
+stagnation = None
 
 for problem in tspproblems:
     max_iter = iters_from_name(problem, 10)
@@ -50,3 +55,7 @@ for problem in tspproblems:
         subprocess.call(cmd, shell=True)
         cmd = execcommand("tspsamples", problem, num_procs, 'aco', 'multiverse', report_step, max_iter, s)
         subprocess.call(cmd, shell=True)
+        cmd = execcommand("tspsamples", problem, num_procs, 'mmas', 'multistart', report_step, max_iter, s)
+        subprocess.call(cmd, shell=True)
+        cmd = execcommand("tspsamples", problem, num_procs, 'mmas', 'multiverse', report_step, max_iter, s)
+        subprocess.call(cmd, shell=True)